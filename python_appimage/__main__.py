@@ -29,6 +29,8 @@ def main():
 
     parser.add_argument('-a', '--appimagetool-version',
         help='set appimagetool version')
+    parser.add_argument('--offline', help='use cached images without '
+        'accessing the network', action='store_true')
     parser.add_argument('-q', '--quiet', help='disable logging',
         dest='verbosity', action='store_const', const='ERROR')
     parser.add_argument('-v', '--verbose', help='print extra information',
@@ -57,10 +59,28 @@ def main():
         help='manylinux image tag(s) (e.g. 2014_x86_64)')
     cache_get_parser.add_argument('-e', '--extract', action='store_true',
         help='extract compressed image data')
+    cache_get_parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='number of concurrent layer downloads and unpacks')
 
     cache_list_parser = cache_subparsers.add_parser('list',
         description='List cached image(s)')
 
+    cache_transcode_parser = cache_subparsers.add_parser('transcode',
+        description='Transcode cached image(s) layers to a faster format')
+    cache_transcode_parser.add_argument('tags', nargs='*',
+        help='manylinux image tag(s) (e.g. 2014_x86_64)')
+    cache_transcode_parser.add_argument('-f', '--format', default='zstd',
+        choices=('tar', 'zstd'), help='target format (default: zstd)')
+    cache_transcode_parser.add_argument('-j', '--jobs', type=int,
+        help='number of concurrent transcoding jobs')
+
+    cache_verify_parser = cache_subparsers.add_parser('verify',
+        description='Verify the integrity of cached image(s)')
+    cache_verify_parser.add_argument('tags', nargs='*',
+        help='manylinux image tag(s) (e.g. 2014_x86_64)')
+    cache_verify_parser.add_argument('-j', '--jobs', type=int,
+        help='number of concurrent hashing jobs')
+
     install_parser = subparsers.add_parser('install',
         description='Install binary dependencies')
     install_parser.add_argument('binary', nargs='+',
@@ -71,20 +91,49 @@ def main():
     build_local_parser.add_argument('-d', '--destination',
                               help='AppImage destination')
     build_local_parser.add_argument('-p', '--python', help='python executable')
+    build_local_parser.add_argument('--compile',
+        help='precompile the bundled Python modules', action='store_true')
+    build_local_parser.add_argument('--optimize', type=int,
+        action='append', choices=(1, 2), metavar='LEVEL',
+        help='also precompile optimized modules (1 for -O, 2 for -OO)')
+    build_local_parser.add_argument('--strip',
+        help='strip debug and unneeded sections from bundled binaries',
+        action='store_true')
+    build_local_parser.add_argument('--keep-debug',
+        help='strip binaries, keeping debug sections as separate files',
+        action='store_true')
 
     build_manylinux_parser = build_subparsers.add_parser('manylinux',
         description='Bundle a manylinux Python installation')
     build_manylinux_parser.add_argument('tag',
         help='manylinux image tag (e.g. 2010_x86_64)')
-    build_manylinux_parser.add_argument('abi',
-        help='python ABI (e.g. cp37-cp37m)')
+    build_manylinux_parser.add_argument('abi', nargs='*',
+        help='python ABI(s) (e.g. cp37-cp37m)')
+    build_manylinux_parser.add_argument('-a', '--all-abis',
+        help='build all CPython ABIs of the image', action='store_true')
     build_manylinux_parser.add_argument('-b', '--bare',
         help='produce a bare image without the AppImage layer',
         action='store_true')
     build_manylinux_parser.add_argument('-c', '--clean',
         help='clean the cache after extraction', action='store_true')
+    build_manylinux_parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='number of concurrent layer downloads, unpacks and builds')
     build_manylinux_parser.add_argument('-n', '--no-packaging',
         help='do not package (compress) the image', action='store_true')
+    build_manylinux_parser.add_argument('--compile',
+        help='precompile the bundled Python modules', action='store_true')
+    build_manylinux_parser.add_argument('--optimize', type=int,
+        action='append', choices=(1, 2), metavar='LEVEL',
+        help='also precompile optimized modules (1 for -O, 2 for -OO)')
+    build_manylinux_parser.add_argument('--no-extract',
+        help='read the image from its compressed layers, without extracting '
+             'it', action='store_true')
+    build_manylinux_parser.add_argument('--strip',
+        help='strip debug and unneeded sections from bundled binaries',
+        action='store_true')
+    build_manylinux_parser.add_argument('--keep-debug',
+        help='strip binaries, keeping debug sections as separate files',
+        action='store_true')
 
     build_app_parser = build_subparsers.add_parser('app',
         description='Build a Python application using a base AppImage')
@@ -108,6 +157,17 @@ def main():
                                   default=False)
     build_app_parser.add_argument('-x', '--extra-data', type=exists,
         help='extra application data (bundled under $APPDIR/)', nargs='+')
+    build_app_parser.add_argument('--compile',
+        help='precompile the bundled Python modules', action='store_true')
+    build_app_parser.add_argument('--optimize', type=int,
+        action='append', choices=(1, 2), metavar='LEVEL',
+        help='also precompile optimized modules (1 for -O, 2 for -OO)')
+    build_app_parser.add_argument('--strip',
+        help='strip debug and unneeded sections from bundled binaries',
+        action='store_true')
+    build_app_parser.add_argument('--keep-debug',
+        help='strip binaries, keeping debug sections as separate files',
+        action='store_true')
 
     list_parser = subparsers.add_parser('list',
         description='List Python versions installed in a manylinux image')
@@ -130,6 +190,10 @@ def main():
         from .utils import deps
         deps.APPIMAGETOOL_VERSION = args.appimagetool_version
 
+    if args.offline:
+        from .manylinux import download
+        download.OFFLINE = True
+
     # check if no arguments are passed
     if args.command is None:
         parser.print_help()
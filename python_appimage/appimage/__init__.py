@@ -1,7 +1,10 @@
 from .build import build_appimage
+from .bytecode import compile_appdir, compile_bytecode
 from .appify import Appifier, tcltk_env_string
 from .relocate import patch_binary, relocate_python
+from .strip import has_binutils, strip_binaries
 
 
-__all__ = ['Appifier', 'build_appimage', 'patch_binary', 'relocate_python',
+__all__ = ['Appifier', 'build_appimage', 'compile_appdir', 'compile_bytecode',
+           'has_binutils', 'patch_binary', 'relocate_python', 'strip_binaries',
            'tcltk_env_string']
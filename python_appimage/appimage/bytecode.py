@@ -0,0 +1,56 @@
+import glob
+import os
+import re
+import shlex
+
+from ..utils.log import log
+from ..utils.system import system
+
+
+__all__ = ['compile_appdir', 'compile_bytecode']
+
+
+def compile_bytecode(python, paths, *, optimize=None):
+    '''Precompile the Python modules of an AppDir, using its interpreter.
+
+    Modules are compiled by parallel workers, as unchecked-hash pycs, since
+    file times are meaningless within an AppImage. Optimized variants are
+    produced for the given optimization levels (1 for -O, 2 for -OO).
+    '''
+
+    levels = [0] + sorted(set(optimize or ()) - {0})
+    for level in levels:
+        flags = ['-I'] + ['-O'] * level
+        log('COMPILE', '%s bytecode%s', os.path.basename(python),
+            f' (-{"O" * level})' if level else '')
+        # Errors (e.g. Python 2 sources in site-packages) are not fatal.
+        # Existing pycs are rewritten, since they might be timestamp based.
+        system([shlex.quote(str(python))] + flags +
+               ['-m', 'compileall', '-f', '-qq', '-j', '0',
+                '--invalidation-mode', 'unchecked-hash'] +
+               [shlex.quote(str(path)) for path in paths])
+
+
+def compile_appdir(appdir, *, optimize=None):
+    '''Precompile the Python runtime(s) bundled in an AppDir.
+
+    Runtimes are located under opt/pythonX.Y, and their packages (including
+    site-packages) are compiled with their own interpreter. Python versions
+    older than 3.7 do not support hash-based pycs, and are skipped.
+    '''
+
+    for prefix in sorted(glob.glob(os.path.join(appdir, 'opt/python*'))):
+        name = os.path.basename(prefix)
+        python = os.path.join(prefix, 'bin', name)
+        # Packages might be flavoured (e.g. lib/python3.13t).
+        packages = sorted(glob.glob(os.path.join(prefix, 'lib', name + '*')))
+        packages = [path for path in packages if os.path.isdir(path)]
+        if not (os.path.exists(python) and packages):
+            continue
+
+        version = tuple(int(v) for v in re.findall(r'\d+', name)[:2])
+        if version < (3, 7):
+            log('WARNING', 'cannot compile %s bytecode (requires Python 3.7+)',
+                name)
+            continue
+        compile_bytecode(python, packages, optimize=optimize)
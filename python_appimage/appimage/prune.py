@@ -0,0 +1,51 @@
+import fnmatch
+import os
+
+
+__all__ = ['MANYLINUX_PRUNED', 'PRUNED_BYTECODE', 'RELOCATE_PRUNED',
+           'is_pruned']
+
+
+PRUNED_BYTECODE = (
+    '**/__pycache__',
+    '**/*.pyc',
+)
+'''Python bytecode, pruned when it cannot be trusted (e.g. from Manylinux
+images).
+'''
+
+MANYLINUX_PRUNED = (
+    'test',
+    *PRUNED_BYTECODE
+)
+'''Content of Manylinux Python packages (lib/pythonX.Y) that is not bundled.
+
+Build configuration files (config-*) are kept, e.g. for python-config or for
+embedding Python.
+'''
+
+RELOCATE_PRUNED = (
+    'config-*-linux-*',
+    'dist-packages',
+    'test',
+    '**/libpython*.a',
+)
+'''Content of local Python packages (lib/pythonX.Y) that is not bundled.'''
+
+
+def is_pruned(relpath, patterns):
+    '''Check if a path (relative to a Python packages directory) is pruned.
+
+    Patterns starting with **/ match at any depth, others at the top level
+    only.
+    '''
+
+    relpath = relpath.replace(os.sep, '/')
+    basename = relpath.rpartition('/')[2]
+    for pattern in patterns:
+        if pattern.startswith('**/'):
+            if fnmatch.fnmatchcase(basename, pattern[3:]):
+                return True
+        elif fnmatch.fnmatchcase(relpath, pattern):
+            return True
+    return False
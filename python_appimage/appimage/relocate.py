@@ -5,13 +5,13 @@ import shutil
 import sys
 
 from .appify import Appifier
+from .prune import is_pruned, RELOCATE_PRUNED
 from ..manylinux import PythonVersion
-from ..utils.deps import EXCLUDELIST, PATCHELF, ensure_excludelist, \
-                         ensure_patchelf
-from ..utils.fs import copy_file, copy_tree, make_tree, remove_file, \
-                       remove_tree
+from ..utils.deps import EXCLUDELIST, ensure_excludelist
+from ..utils.fs import copy_file, copy_tree, make_tree
+from ..utils.elf import ldd, set_rpath
 from ..utils.log import log
-from ..utils.system import ldd, system
+from ..utils.system import system
 
 
 __all__ = ['patch_binary', 'relocate_python']
@@ -42,13 +42,9 @@ def patch_binary(path, libdir, recursive=True):
 
     deps = ldd(path) # Fetch deps before patching RPATH.
 
-    ensure_patchelf()
-    rpath = '\'' + system((PATCHELF, '--print-rpath', path)) + '\''
     relpath = os.path.relpath(libdir, os.path.dirname(path))
     relpath = '' if relpath == '.' else '/' + relpath
-    expected = '\'$ORIGIN' + relpath + ':$ORIGIN/../lib\''
-    if rpath != expected:
-        system((PATCHELF, '--set-rpath', expected, path))
+    set_rpath(path, '$ORIGIN' + relpath + ':$ORIGIN/../lib')
 
     for dep in deps:
         name = os.path.basename(dep)
@@ -133,7 +129,7 @@ def relocate_python(python=None, appdir=None):
     target = PYTHON_BIN + '/' + PYTHON_X_Y
     copy_file(source, target, update=True)
 
-    copy_tree(HOST_PKG, PYTHON_PKG)
+    copy_tree(HOST_PKG, PYTHON_PKG, ignore=_is_pruned)
     copy_tree(HOST_INC, PYTHON_INC)
 
     make_tree(APPDIR_BIN)
@@ -159,17 +155,6 @@ def relocate_python(python=None, appdir=None):
         shutil.copymode(pip_source, target)
 
 
-    # Remove unrelevant files
-    log('PRUNE', '%s packages', PYTHON_X_Y)
-
-    remove_file(PYTHON_LIB + '/lib' + PYTHON_X_Y + '.a')
-    remove_tree(PYTHON_PKG + '/test')
-    remove_file(PYTHON_PKG + '/dist-packages')
-    matches = glob.glob(PYTHON_PKG + '/config-*-linux-*')
-    for path in matches:
-        remove_tree(path)
-
-
     # Set RPATHs and bundle external libraries
     log('LINK', '%s C-extensions', PYTHON_X_Y)
 
@@ -221,6 +206,11 @@ def relocate_python(python=None, appdir=None):
     appifier.appify()
 
 
+def _is_pruned(relpath):
+    '''Check if a path of Python packages is pruned.'''
+    return is_pruned(relpath, RELOCATE_PRUNED)
+
+
 def _get_tk_version(python_pkg):
     tkinter = glob.glob(python_pkg + '/lib-dynload/_tkinter*.so')
     if tkinter:
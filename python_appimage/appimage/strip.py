@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import platform
+import shlex
+import shutil
+import stat
+
+from ..utils.log import debug, log
+from ..utils.system import system
+
+
+__all__ = ['has_binutils', 'strip_binaries']
+
+
+_COMPATIBLE = {
+    'i686': ('i686', 'x86_64'),
+    'x86_64': ('x86_64',),
+    'aarch64': ('aarch64',)
+}
+'''Host architectures whose native binutils handle a target architecture.'''
+
+
+_tools = {}
+
+
+def _find_tools(arch):
+    '''Locate binutils strip and objcopy, for a target architecture.
+
+    Native tools are preferred when they handle the target architecture.
+    Otherwise, target-prefixed tools (e.g. aarch64-linux-gnu-strip) are
+    required. Lookups are cached.
+    '''
+
+    arch = str(arch)
+    try:
+        return _tools[arch]
+    except KeyError:
+        pass
+
+    prefixes = [f'{arch}-linux-gnu-']
+    if platform.machine() in _COMPATIBLE.get(arch, (arch,)):
+        prefixes.insert(0, '')
+    tools = (None, None)
+    for prefix in prefixes:
+        strip = shutil.which(f'{prefix}strip')
+        objcopy = shutil.which(f'{prefix}objcopy')
+        if strip and objcopy:
+            tools = (strip, objcopy)
+            break
+    _tools[arch] = tools
+    return tools
+
+
+def has_binutils(arch=None):
+    '''Check if binaries of a target architecture can be stripped.'''
+
+    if arch is None:
+        arch = platform.machine()
+    return _find_tools(arch)[0] is not None
+
+
+def _is_elf(path):
+    with open(path, 'rb') as f:
+        return f.read(4) == b'\x7fELF'
+
+
+def strip_binaries(appdir, *, arch=None, debug_dir=None):
+    '''Strip debug and unneeded sections from the ELF objects of an AppDir.
+
+    Shared libraries, Python extension modules and executables are stripped
+    concurrently. If debug_dir is provided, debug sections are kept there,
+    as separate files linked from stripped objects (with .gnu_debuglink).
+    Returns the total size saved, in bytes.
+    '''
+
+    if arch is None:
+        arch = platform.machine()
+    strip, objcopy = _find_tools(arch)
+    if strip is None:
+        log('WARNING', f'could not find binutils for {arch}, not stripping')
+        return 0
+
+    paths = []
+    for root, _, files in os.walk(appdir):
+        for file_ in files:
+            path = os.path.join(root, file_)
+            if (not os.path.islink(path)) and _is_elf(path):
+                paths.append(path)
+
+    def strip_binary(path):
+        relpath = os.path.relpath(path, appdir)
+        size = os.path.getsize(path)
+        mode = os.stat(path).st_mode
+        if not (mode & stat.S_IWUSR):
+            os.chmod(path, mode | stat.S_IWUSR)
+        try:
+            if debug_dir is None:
+                system((strip, '--strip-unneeded', shlex.quote(path)))
+            else:
+                debug_file = os.path.join(debug_dir, relpath + '.debug')
+                os.makedirs(os.path.dirname(debug_file), exist_ok=True)
+                system((objcopy, '--only-keep-debug', shlex.quote(path),
+                        shlex.quote(debug_file)))
+                # Replace any previous link (e.g. to a system debug file).
+                system((strip, '--strip-unneeded',
+                        '--remove-section=.gnu_debuglink', shlex.quote(path)))
+                system((objcopy,
+                        shlex.quote(f'--add-gnu-debuglink={debug_file}'),
+                        shlex.quote(path)))
+        except RuntimeError as e:
+            debug('STRIP', '%s', e)
+            log('WARNING', 'could not strip %s', relpath)
+            return 0
+        finally:
+            os.chmod(path, mode)
+
+        saved = size - os.path.getsize(path)
+        if saved > 0:
+            log('STRIP', '%s (-%.1f kB)', relpath, saved / 2**10)
+        return saved
+
+    with ThreadPoolExecutor() as executor:
+        saved = sum(executor.map(strip_binary, paths))
+
+    log('STRIP', '%d binaries (-%.1f MB)', len(paths), saved / 2**20)
+    return saved
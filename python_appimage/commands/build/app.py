@@ -7,7 +7,7 @@ import re
 import stat
 import struct
 
-from ...appimage import build_appimage
+from ...appimage import build_appimage, compile_appdir, strip_binaries
 from ...utils.compat import find_spec
 from ...utils.deps import PREFIX
 from ...utils.fs import copy_file, copy_tree, make_tree, remove_file, remove_tree
@@ -27,7 +27,8 @@ def _unpack_args(args):
     '''
     return args.appdir, args.name, args.python_version, args.linux_tag,        \
            args.python_tag, args.base_image, args.in_tree_build,               \
-           args.extra_data, args.no_packaging
+           args.extra_data, args.no_packaging, args.compile, args.optimize,    \
+           args.strip, args.keep_debug
 
 
 _tag_pattern = re.compile('python([^-]+)[-]([^.]+)[.]AppImage')
@@ -36,8 +37,13 @@ _linux_pattern = re.compile('manylinux([0-9]+)_' + platform.machine())
 
 def execute(appdir, name=None, python_version=None, linux_tag=None,
             python_tag=None, base_image=None, in_tree_build=False,
-            extra_data=None, no_packaging=None):
+            extra_data=None, no_packaging=None, compile_=False, optimize=None,
+            strip=False, keep_debug=False):
     '''Build a Python application using a base AppImage
+
+    If compile_ is true, or optimization levels are given, Python modules
+    (including installed requirements) are precompiled with the bundled
+    interpreter.
     '''
 
     if base_image is None:
@@ -322,6 +328,13 @@ def execute(appdir, name=None, python_version=None, linux_tag=None,
 
         # Build the new AppImage
         fullname = '{:}-{:}'.format(application_name, platform.machine())
+        if strip or keep_debug:
+            debug_dir = None
+            if keep_debug:
+                debug_dir = os.path.join(pwd, fullname + '.debug')
+            strip_binaries('AppDir', debug_dir=debug_dir)
+        if compile_ or optimize:
+            compile_appdir('AppDir', optimize=optimize)
         if no_packaging:
             copy_tree('AppDir', Path(pwd) / fullname)
         else:
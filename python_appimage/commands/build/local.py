@@ -2,7 +2,8 @@ import glob
 import os
 import shutil
 
-from ...appimage import build_appimage, relocate_python
+from ...appimage import build_appimage, compile_appdir, relocate_python, \
+                         strip_binaries
 from ...utils.tmp import TemporaryDirectory
 
 
@@ -12,16 +13,28 @@ __all__ = ['execute']
 def _unpack_args(args):
     '''Unpack command line arguments
     '''
-    return args.python, args.destination
+    return args.python, args.destination, args.compile, args.optimize, \
+           args.strip, args.keep_debug
 
 
-def execute(python=None, destination=None):
+def execute(python=None, destination=None, compile_=False, optimize=None,
+            strip=False, keep_debug=False):
     '''Build a Python AppImage using a local installation
+
+    If compile_ is true, or optimization levels are given, Python modules are
+    precompiled with the bundled interpreter.
     '''
     pwd = os.getcwd()
     with TemporaryDirectory() as tmpdir:
         relocate_python(python)
 
+        debug_dir = os.path.join(tmpdir, 'debug') if keep_debug else None
+        if strip or keep_debug:
+            strip_binaries('AppDir', debug_dir=debug_dir)
+
+        if compile_ or optimize:
+            compile_appdir('AppDir', optimize=optimize)
+
         dirname, pattern = None, None
         if destination is not None:
             dirname, destination = os.path.split(destination)
@@ -37,3 +50,6 @@ def execute(python=None, destination=None):
             dirname = os.path.abspath(dirname)
             os.chdir(tmpdir)
         shutil.move(appimage, os.path.join(dirname, appimage))
+        if (debug_dir is not None) and os.path.exists(debug_dir):
+            name = os.path.splitext(appimage)[0] + '.debug'
+            shutil.move(debug_dir, os.path.join(dirname, name))
@@ -1,12 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
 import os
 from pathlib import Path
 import tarfile
+from types import SimpleNamespace
 
-from ...appimage import build_appimage
-from ...manylinux import ensure_image, PythonExtractor
+from ...appimage import build_appimage, compile_bytecode, has_binutils, \
+                         strip_binaries
+from ...manylinux import Arch, ensure_image, PythonExtractor
+from ...manylinux.builds import BuildCache
+from ...utils.deps import APPIMAGETOOL_VERSION, ensure_appimagetool
 from ...utils.fs import copy_file, copy_tree
 from ...utils.log import log
 from ...utils.tmp import TemporaryDirectory
+from ...version import version
 
 
 __all__ = ['execute']
@@ -15,55 +22,219 @@ __all__ = ['execute']
 def _unpack_args(args):
     '''Unpack command line arguments
     '''
-    return args.tag, args.abi, args.bare, args.clean, args.no_packaging
+    return args.tag, args.abi, args.bare, args.clean, args.no_packaging, \
+           args.jobs, args.no_extract, args.all_abis, args.compile, \
+           args.optimize, args.strip, args.keep_debug
 
 
-def execute(tag, abi, bare=False, clean=False, no_packaging=False):
-    '''Build a Python AppImage using a Manylinux image
+def execute(tag, abi=None, bare=False, clean=False, no_packaging=False,
+            jobs=1, no_extract=False, all_abis=False, compile_=False,
+            optimize=None, strip=False, keep_debug=False):
+    '''Build Python AppImage(s) using a Manylinux image
+
+    Several ABIs can be given. Then, the image is prepared once, and library
+    lookups are shared between builds. AppImages are packaged concurrently,
+    by up to jobs workers.
+
+    Build outputs are cached, keyed on the image content, the ABI, the
+    python-appimage version and the build options. Unchanged outputs are
+    reused, and the extracted Python runtime is reused when only the AppImage
+    specific steps differ.
+
+    If compile_ is true, or optimization levels are given, Python modules are
+    precompiled with the bundled interpreter (for the host architecture only).
+
+    If strip is true, debug and unneeded sections are removed from binaries.
+    With keep_debug, debug sections are kept as separate files, next to the
+    outputs.
     '''
 
-    image = ensure_image(tag, clean=clean)
+    if isinstance(abi, str):
+        abis = [abi]
+    else:
+        abis = list(abi or [])
+    if not abis and not all_abis:
+        raise ValueError('missing python ABI')
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    # Selective extraction applies to a single ABI.
+    selective = (len(abis) == 1) and not all_abis
+    image = ensure_image(tag, abi=abis[0] if selective else None,
+                         clean=clean, jobs=jobs, virtual=no_extract)
+
+    if all_abis:
+        for path in sorted(image.index.glob(image.path / 'opt/python/cp*')):
+            name = Path(path).name
+            if name not in abis:
+                abis.append(name)
+
+    sources = image.index.sources()
+
+    if optimize:
+        compile_ = True
+    if keep_debug:
+        strip = True
+    if compile_ and (image.arch != Arch.from_host()):
+        log('WARNING', f'cannot compile {image.arch} bytecode on this host')
+        compile_ = False
+    levels = sorted({0, *(optimize or ())}) if compile_ else None
+    if strip and not has_binutils(image.arch):
+        log('WARNING', f'could not find binutils for {image.arch}, not '
+                       'stripping')
+        strip, keep_debug = False, False
 
     pwd = os.getcwd()
     with TemporaryDirectory() as tmpdir:
-        python_extractor = PythonExtractor(
-            arch = image.arch,
-            prefix = image.path,
-            tag = abi
-        )
-        appdir = Path(tmpdir) / 'AppDir'
-        appify = not bare
-        python_extractor.extract(appdir, appify=appify)
-
-        fullname = '-'.join((
-            f'{python_extractor.impl}{python_extractor.version.long()}',
-            abi,
-            f'{image.tag}_{image.arch}'
-        ))
-
-        if no_packaging:
-            copy_tree(
-                Path(tmpdir) / 'AppDir',
-                Path(pwd) / fullname
-            )
-        elif bare:
-            log('COMPRESS', fullname)
-            destination = f'{fullname}.tar.gz'
-            tar_path = Path(tmpdir) / destination
-            with tarfile.open(tar_path, "w:gz") as tar:
-                tar.add(appdir, arcname=fullname)
-            copy_file(
-                tar_path,
-                Path(pwd) / destination
-            )
+        builds = []
+        python_extractor = None
+        for abi in abis:
+            if python_extractor is None:
+                python_extractor = PythonExtractor(
+                    arch = image.arch,
+                    prefix = image.path,
+                    tag = abi,
+                    image_extractor = image.extractor,
+                    view = image.view,
+                    index = image.index
+                )
+            else:
+                # Share the exclude list and the libraries cache.
+                python_extractor = dataclasses.replace(python_extractor,
+                                                       tag=abi)
+
+            fullname = '-'.join((
+                f'{python_extractor.impl}{python_extractor.version.long()}',
+                abi,
+                f'{image.tag}_{image.arch}'
+            ))
+
+            target = f'{image.tag}_{image.arch}:{image.image_tag}@{abi}'
+            runtime = BuildCache('runtime', target, {
+                'sources': sources,
+                'version': version,
+                'excluded': sorted(python_extractor.excluded)
+            })
+            if no_packaging:
+                stage, output = 'appdir', fullname
+            elif bare:
+                stage, output = 'tarball', f'{fullname}.tar.gz'
+            else:
+                stage, output = 'appimage', f'{fullname}.AppImage'
+            artifact = BuildCache(stage, target, {
+                'runtime': runtime.key,
+                'appify': not bare,
+                'appimagetool': APPIMAGETOOL_VERSION,
+                'bytecode': levels,
+                'strip': 'debug' if keep_debug else strip
+            })
+
+            # Debug files (if kept) are cached along with the artifact.
+            debug = dataclasses.replace(artifact, stage=f'{stage}.debug') \
+                    if keep_debug else None
+
+            cached = artifact.lookup()
+            debug_cached = debug.lookup() if keep_debug else None
+            if (cached is not None) and \
+               ((debug_cached is not None) or not keep_debug):
+                log('REUSE', output)
+                outputs = [cached]
+                if debug_cached is not None:
+                    outputs.append(debug_cached)
+                builds.append(SimpleNamespace(appdir=None, outputs=outputs))
+                continue
+
+            appdir = Path(tmpdir) / f'{abi}.AppDir'
+            cached = runtime.lookup()
+            if cached is None:
+                python_extractor.extract(appdir)
+                runtime.store(appdir)
+            else:
+                log('REUSE', f'{python_extractor.impl}'
+                             f'{python_extractor.version.long()} runtime')
+                copy_tree(cached, appdir, update=False)
+
+            if not bare:
+                python_extractor.appify(appdir)
+
+            if levels and (python_extractor.version.major, \
+                           python_extractor.version.minor) >= (3, 7):
+                flavoured_python = \
+                    f'python{python_extractor.version.flavoured()}'
+                python_dest = appdir / f'opt/{flavoured_python}'
+                bytecode = (
+                    str(python_dest / f'bin/{flavoured_python}'),
+                    [python_dest / f'lib/{flavoured_python}']
+                )
+            else:
+                bytecode = None
+
+            builds.append(SimpleNamespace(
+                appdir = appdir,
+                output = output,
+                artifact = artifact,
+                bytecode = bytecode,
+                debug = debug,
+                debug_dir = Path(tmpdir) / f'{fullname}.debug' \
+                            if keep_debug else None,
+                outputs = []
+            ))
+
+        def package(build):
+            # Paths are absolute, since packaging runs in worker threads.
+            if build.appdir is not None:
+                source = build.appdir
+                if strip:
+                    strip_binaries(source, arch=str(image.arch),
+                                   debug_dir=build.debug_dir)
+
+                if build.bytecode is not None:
+                    python, paths = build.bytecode
+                    compile_bytecode(python, paths, optimize=levels)
+
+                path = source.parent / build.output
+                if no_packaging:
+                    source.rename(path)
+                elif bare:
+                    log('COMPRESS', build.output[:-7])
+                    with tarfile.open(path, "w:gz") as tar:
+                        tar.add(source, arcname=build.output[:-7])
+                else:
+                    build_appimage(
+                        appdir = str(source),
+                        arch = str(image.arch),
+                        destination = str(path)
+                    )
+                build.outputs.append(build.artifact.store(path))
+                if (build.debug_dir is not None) and build.debug_dir.exists():
+                    build.outputs.append(build.debug.store(build.debug_dir))
+
+            for source in build.outputs:
+                if source.is_dir():
+                    copy_tree(
+                        str(source),
+                        str(Path(pwd) / source.name)
+                    )
+                else:
+                    copy_file(
+                        str(source),
+                        str(Path(pwd) / source.name)
+                    )
+
+        if not (bare or no_packaging) and \
+           any(build.appdir is not None for build in builds):
+            # Installing appimagetool changes the working directory. Thus, it
+            # must not run concurrently.
+            ensure_appimagetool()
+
+        workers = min(len(builds), jobs)
+        if workers <= 1:
+            for build in builds:
+                package(build)
         else:
-            destination = f'{fullname}.AppImage'
-            build_appimage(
-                appdir = str(appdir),
-                arch = str(image.arch),
-                destination = destination
-            )
-            copy_file(
-                Path(tmpdir) / destination,
-                Path(pwd) / destination
-            )
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(package, build)
+                           for build in builds]
+                for future in futures:
+                    future.result()
@@ -1,9 +1,10 @@
 import glob
-import json
 import os
 from pathlib import Path
 import subprocess
 
+from ...manylinux.builds import remove_builds
+from ...manylinux.download import remove_unused_blobs, remove_unused_layers
 from ...utils.deps import CACHE_DIR
 from ...utils.fs import remove_file, remove_tree
 from ...utils.log import log
@@ -41,6 +42,12 @@ def execute(images, all_):
         if not path.exists():
             raise ValueError(f'no such image ({image})')
 
+        # Build outputs depend on the image content.
+        if tag is None:
+            remove_builds(f'manylinux{image}:')
+        else:
+            remove_builds(f'manylinux{image}:{tag}@')
+
         if tag is None:
             if not all_:
                 path = path / 'extracted'
@@ -51,14 +58,21 @@ def execute(images, all_):
                 raise ValueError(f'no such image ({image}:{tag})')
 
             if all_:
-                with tag_file.open() as f:
-                    layers = json.load(f)["layers"]
-                for layer in layers:
-                    layer = path / f'layers/{layer}.tar.gz'
-                    if layer.exists():
-                        remove_file(str(layer))
                 remove_file(str(tag_file))
             else:
-                path = cache / f'share/images/{image}/extracted/{tag}'
-                if path.exists():
-                    remove_tree(str(path))
+                extracted = path / f'extracted/{tag}'
+                if extracted.exists():
+                    remove_tree(str(extracted))
+                index = path / f'extracted/{tag}.sqlite'
+                if index.exists():
+                    remove_file(str(index))
+                # Selective extractions, for specific Python binary tags.
+                for extracted in glob.glob(str(path / f'extracted/{tag}@*')):
+                    remove_tree(extracted)
+
+    if all_:
+        # Layers are shared between images. Thus, only unreferenced ones are
+        # removed.
+        remove_unused_blobs()
+    else:
+        remove_unused_layers()
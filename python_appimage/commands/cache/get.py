@@ -7,12 +7,12 @@ __all__ = ['execute']
 def _unpack_args(args):
     '''Unpack command line arguments
     '''
-    return (args.tags, args.extract)
+    return (args.tags, args.extract, args.jobs)
 
 
-def execute(images, extract):
+def execute(images, extract, jobs=1):
     '''Download image(s) to the cache
     '''
 
     for image in images:
-        ensure_image(image, extract=extract)
+        ensure_image(image, extract=extract, jobs=jobs)
@@ -34,6 +34,18 @@ def execute():
         memory = _getsize(path)
         log('LIST', f'{image} ({tags}) [{memory}]')
 
+    blobs = cache / 'share/blobs'
+    if blobs.exists():
+        n = len(glob.glob(str(blobs / '*.tar.gz')))
+        memory = _getsize(blobs)
+        log('LIST', f'layers ({n} blobs) [{memory}]')
+
+    layers = cache / 'share/layers'
+    if layers.exists():
+        n = len(glob.glob(str(layers / '*.json')))
+        memory = _getsize(layers)
+        log('LIST', f'unpacked layers ({n}) [{memory}]')
+
 
 def _getsize(path: Path):
     r = subprocess.run(f'du -sh {path}', capture_output=True, check=True,
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import os
+from pathlib import Path
+
+from ...manylinux.download import BLOBS_DIR
+from ...manylinux.transcode import transcode_layer
+from ...utils.deps import CACHE_DIR
+from ...utils.log import log
+
+
+__all__ = ['execute']
+
+
+def _unpack_args(args):
+    '''Unpack command line arguments
+    '''
+    return (args.tags, args.format, args.jobs)
+
+
+def execute(images, format_='zstd', jobs=None):
+    '''Transcode cached image(s) layers to a faster format
+    '''
+
+    cache = Path(CACHE_DIR)
+
+    if images:
+        hashes = set()
+        for image in images:
+            if not image.replace('_', '').isalnum():
+                raise ValueError(f'bad image tag ({image})')
+
+            path = cache / f'share/images/manylinux{image}'
+            if not path.exists():
+                raise ValueError(f'no such image ({image})')
+
+            for tag in glob.glob(str(path / 'tags/*.json')):
+                with open(tag) as f:
+                    hashes |= set(json.load(f)['layers'])
+        hashes = [hash_ for hash_ in sorted(hashes)
+                  if (BLOBS_DIR / f'{hash_}.tar.gz').exists()]
+    else:
+        hashes = [Path(layer).name[:-7] for layer in
+                  sorted(glob.glob(str(BLOBS_DIR / '*.tar.gz')))]
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        paths = list(executor.map(lambda hash_: transcode_layer(hash_, format_),
+                                  hashes))
+
+    size = sum(path.stat().st_size for path in paths)
+    log('TRANSCODE', f'{len(paths)} layers to {format_} '
+                     f'({size / 2**20:.1f} MB)')
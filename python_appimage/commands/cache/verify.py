@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import os
+from pathlib import Path
+
+from ...manylinux.download import BLOBS_DIR, verify_layer
+from ...manylinux.transcode import SUFFIXES, verify_transcoded
+from ...utils.deps import CACHE_DIR
+from ...utils.fs import remove_file
+from ...utils.log import log
+
+
+__all__ = ['execute']
+
+
+def _unpack_args(args):
+    '''Unpack command line arguments
+    '''
+    return (args.tags, args.jobs)
+
+
+def execute(images, jobs=None):
+    '''Verify the integrity of cached image(s) layers
+    '''
+
+    cache = Path(CACHE_DIR)
+
+    if images:
+        hashes = set()
+        for image in images:
+            if not image.replace('_', '').isalnum():
+                raise ValueError(f'bad image tag ({image})')
+
+            path = cache / f'share/images/manylinux{image}'
+            if not path.exists():
+                raise ValueError(f'no such image ({image})')
+
+            for tag in glob.glob(str(path / 'tags/*.json')):
+                with open(tag) as f:
+                    hashes |= set(json.load(f)['layers'])
+        layers = [BLOBS_DIR / f'{hash_}.tar.gz' for hash_ in sorted(hashes)]
+        layers = [layer for layer in layers if layer.exists()]
+    else:
+        layers = [Path(layer) for layer in
+                  sorted(glob.glob(str(BLOBS_DIR / '*.tar.gz')))]
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    transcoded = []
+    for layer in layers:
+        hash_ = layer.name[:-7]
+        for format_ in ('tar', 'zstd'):
+            path = BLOBS_DIR / f'{hash_}{SUFFIXES[format_]}'
+            if path.exists():
+                transcoded.append(path)
+
+    def verify(path):
+        if path.name.endswith('.tar.gz'):
+            return verify_layer(path, path.name[:-7], force=True)
+        else:
+            hash_ = path.name.split('.', 1)[0]
+            return verify_transcoded(path, hash_, force=True)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(verify, layers + transcoded))
+
+    corrupted = 0
+    for path, valid in zip(layers + transcoded, results):
+        if not valid:
+            log('CORRUPT', f'blobs/{path.name}')
+            remove_file(str(path))
+            if path in layers:
+                corrupted += 1
+
+    log('VERIFY', f'{len(layers) - corrupted} / {len(layers)} valid layers')
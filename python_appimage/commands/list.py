@@ -1,4 +1,3 @@
-import glob
 from pathlib import Path
 
 from ..manylinux import ensure_image, PythonVersion
@@ -21,9 +20,10 @@ def execute(tag):
     image = ensure_image(tag)
 
     pythons = []
-    for path in glob.glob(str(image.path / 'opt/python/cp*')):
+    for path in image.index.glob(image.path / 'opt/python/cp*'):
         path = Path(path)
-        version = PythonVersion.from_str(path.readlink().name[8:]).long()
+        link = Path(image.index.readlink(path))
+        version = PythonVersion.from_str(link.name[8:]).long()
         pythons.append((path.name, version))
     pythons = sorted(pythons)
 
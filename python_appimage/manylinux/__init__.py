@@ -1,3 +1,4 @@
+import os
 from types import SimpleNamespace
 
 from .config import Arch, LinuxTag, PythonImpl, PythonVersion
@@ -10,8 +11,18 @@ __all__ = ['Arch', 'Downloader', 'ensure_image', 'ImageExtractor', 'LinuxTag',
            'Patcher', 'PythonExtractor', 'PythonImpl', 'PythonVersion']
 
 
-def ensure_image(tag, *, clean=False, extract=True):
-    '''Download a manylinux image to the cache'''
+def ensure_image(tag, *, abi=None, clean=False, extract=True, jobs=1,
+                 virtual=False):
+    '''Download a manylinux image to the cache
+
+    If a Python binary tag (abi) is provided, only the files that it requires
+    are extracted. If virtual is true, the image is not extracted. Instead, a
+    read-only view of its compressed layers is returned. If jobs is None, the
+    number of CPUs is used.
+    '''
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
 
     try:
         tag, image_tag = tag.rsplit(':', 1)
@@ -27,26 +38,56 @@ def ensure_image(tag, *, clean=False, extract=True):
     arch = Arch.from_str(arch)
 
     downloader = Downloader(tag=tag, arch=arch)
-    downloader.download(tag=image_tag)
 
-    if extract:
+    if virtual:
+        downloader.download(tag=image_tag, jobs=jobs)
         image_extractor = ImageExtractor(
             prefix = downloader.default_destination(),
             tag = image_tag
         )
-        image_extractor.extract(clean=clean)
+        patcher = Patcher(tag=tag, arch=arch)
+        view = image_extractor.view(patches=patcher.patches())
+        index = image_extractor.index(patches=patcher.patches())
+
+        return SimpleNamespace(
+            arch = arch,
+            tag = tag,
+            image_tag = image_tag,
+            path = view.root,
+            extractor = None,
+            view = view,
+            index = index,
+        )
+    elif extract:
+        # Layers are extracted while downloading. The final extract call only
+        # completes any missing layer (e.g. if the image was already cached).
+        image_extractor = ImageExtractor(
+            prefix = downloader.default_destination(),
+            tag = image_tag,
+            abi = abi
+        )
+        downloader.download(tag=image_tag, jobs=jobs,
+                            consumer=image_extractor.stream())
+        image_extractor.extract(clean=clean, jobs=jobs)
 
         patcher = Patcher(tag=tag, arch=arch)
         patcher.patch(destination = image_extractor.default_destination())
+        index = image_extractor.index(patches=patcher.patches())
 
         return SimpleNamespace(
             arch = arch,
             tag = tag,
+            image_tag = image_tag,
             path = image_extractor.default_destination(),
+            extractor = image_extractor,
+            view = None,
+            index = index,
         )
     else:
+        downloader.download(tag=image_tag, jobs=jobs)
         return SimpleNamespace(
             arch = arch,
             tag = tag,
+            image_tag = image_tag,
             path = downloader.default_destination(),
         )
@@ -0,0 +1,128 @@
+from dataclasses import dataclass, field
+import glob
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+from typing import Any, Dict, Optional
+
+from ..utils.deps import CACHE_DIR
+from ..utils.fs import copy_file, copy_tree
+from ..utils.log import debug
+
+
+__all__ = ['BuildCache', 'remove_builds']
+
+
+BUILDS_DIR = Path(CACHE_DIR) / 'share/builds'
+'''Cache of build outputs (e.g. Python runtimes or AppImages).'''
+
+
+@dataclass(frozen=True)
+class BuildCache:
+    '''Cache entry for the output of a build stage, keyed on its inputs.
+
+    Storing an output replaces the previous one of the same target (i.e. with
+    the same stage and name), if any.
+    '''
+
+    stage: str
+    '''Build stage (e.g. runtime)'''
+
+    name: str
+    '''Build target (e.g. manylinux2014_x86_64:latest@cp313-cp313)'''
+
+    inputs: Dict[str, Any]
+    '''Inputs of the build stage'''
+
+    key: str = field(init=False)
+    '''Digest of the stage, target and inputs'''
+
+    def __post_init__(self):
+        data = json.dumps([self.stage, self.name, self.inputs],
+                          sort_keys=True)
+        key = hashlib.sha256(data.encode()).hexdigest()
+        object.__setattr__(self, 'key', key)
+
+    @property
+    def path(self) -> Path:
+        return BUILDS_DIR / self.key
+
+    def lookup(self) -> Optional[Path]:
+        '''Get the cached output, if any.'''
+
+        try:
+            with open(BUILDS_DIR / f'{self.key}.json') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        output = self.path / meta['output']
+        if not os.path.lexists(output):
+            return None
+        debug('CACHE', f'{self.stage} of {self.name} ({self.key[:12]})')
+        return output
+
+    def store(self, source: Path) -> Path:
+        '''Store a build output (a file or a directory) in the cache.'''
+
+        source = Path(source)
+        debug('CACHE', f'{self.stage} of {self.name} ({self.key[:12]})')
+        BUILDS_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = BUILDS_DIR / f'{self.key}.{os.getpid()}'
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            tmp.mkdir()
+            if source.is_dir():
+                copy_tree(source, tmp / source.name, update=False)
+            else:
+                copy_file(source, tmp / source.name, verbose=False)
+            self._remove(self.key)
+            os.replace(tmp, self.path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        # The entry is valid once its metadata are written.
+        meta = {
+            'stage': self.stage,
+            'name': self.name,
+            'inputs': self.inputs,
+            'output': source.name
+        }
+        tmp = BUILDS_DIR / f'{self.key}.json.{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, BUILDS_DIR / f'{self.key}.json')
+
+        # Remove outputs of previous builds of the same target.
+        for key, other in _entries():
+            if (key != self.key) and (other['stage'] == self.stage) and \
+               (other['name'] == self.name):
+                self._remove(key)
+
+        return self.path / source.name
+
+    @staticmethod
+    def _remove(key: str):
+        (BUILDS_DIR / f'{key}.json').unlink(missing_ok=True)
+        shutil.rmtree(BUILDS_DIR / key, ignore_errors=True)
+
+
+def _entries():
+    for path in glob.glob(str(BUILDS_DIR / '*.json')):
+        try:
+            with open(path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        yield Path(path).name[:-5], meta
+
+
+def remove_builds(prefix: Optional[str]=None):
+    '''Remove cached build outputs, e.g. for targets starting with a prefix.'''
+
+    for key, meta in _entries():
+        if (prefix is None) or meta['name'].startswith(prefix):
+            debug('REMOVE', f'{meta["stage"]} of {meta["name"]}')
+            BuildCache._remove(key)
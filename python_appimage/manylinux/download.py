@@ -1,11 +1,15 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass, field
 import glob
 import hashlib
 import json
+import os
 from pathlib import Path
 import requests
 import shutil
-import tempfile
+import threading
+import time
 from typing import Optional
 
 from .config import Arch, LinuxTag
@@ -15,13 +19,252 @@ from ..utils.log import debug, log
 
 CHUNK_SIZE = 8189
 
+BUFFER_SIZE = 1024 * 1024
+'''Read buffer size, when hashing files.'''
+
+REGISTRY_URL = 'https://quay.io'
+'''Base URL of the container registry.'''
+
+BLOBS_DIR = Path(CACHE_DIR) / 'share/blobs'
+'''Content-addressed store of image layers, shared by all images.'''
+
+LAYERS_DIR = Path(CACHE_DIR) / 'share/layers'
+'''Store of unpacked image layers, shared by all images.'''
+
+PARTIAL_TTL = 7 * 24 * 3600
+'''Time (in seconds) after which an unused partial download is removed.'''
+
+RETRIES = 5
+'''Number of attempts at resuming an interrupted layer download.'''
+
+SPLIT_SIZE = 64 * 1024 * 1024
+'''Size above which a layer is fetched as several byte ranges.'''
+
+RANGE_SIZE = 16 * 1024 * 1024
+'''Size of byte ranges, when fetching a layer over several connections.'''
+
+POOL_SIZE = 16
+'''Maximum number of kept-alive connections to the registry.'''
+
+TOKEN_MARGIN = 10
+'''Time margin (in seconds) for renewing an authentication token.'''
+
+TAG_TTL = 3600
+'''Time (in seconds) during which a cached tag is not checked for updates.'''
+
+OFFLINE = False
+'''Use cached tags without accessing the network.'''
+
 SUCCESS = 200
+PARTIAL_CONTENT = 206
+UNAUTHORIZED = 401
+RANGE_NOT_SATISFIABLE = 416
 
 
 class DownloadError(Exception):
     pass
 
 
+class _RangeError(Exception):
+    '''The registry does not serve byte ranges.'''
+
+
+_session = None
+'''HTTP session shared by all downloaders.'''
+
+_tokens = {}
+'''Cache of authentication tokens, per repository.'''
+
+_lock = threading.Lock()
+
+
+def hash_file(path, hasher=None):
+    '''Feed a file content to a (sha256) hasher
+
+    Returns the hasher and the number of bytes read.
+    '''
+
+    if hasher is None:
+        hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(BUFFER_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher, size
+
+
+def record_verification(path, hash_, *, source=None):
+    '''Record that a cached layer matches its digest
+
+    The record is stored besides the layer, as a .verified sidecar file. It
+    holds the file status at the time of the verification, and the digest of
+    the source layer for transcoded ones.
+    '''
+
+    path = Path(path)
+    st = path.stat()
+    record = {
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'inode': st.st_ino,
+        'digest': f'sha256:{hash_}'
+    }
+    if source is not None:
+        record['source'] = f'sha256:{source}'
+    sidecar = path.with_name(f'{path.name}.verified')
+    tmp = path.with_name(f'{path.name}.verified.tmp')
+    with tmp.open('w') as f:
+        json.dump(record, f)
+    os.replace(tmp, sidecar)
+
+
+def verify_layer(path, hash_, *, force=False, source=None):
+    '''Check that a cached layer matches its digest
+
+    Unless *force* is set, a layer that is unchanged since its last
+    verification is trusted without being rehashed.
+    '''
+
+    path = Path(path)
+    sidecar = path.with_name(f'{path.name}.verified')
+
+    if not force:
+        try:
+            with sidecar.open() as f:
+                record = json.load(f)
+            st = path.stat()
+        except (OSError, ValueError):
+            pass
+        else:
+            if (record.get('digest') == f'sha256:{hash_}') and \
+               (record.get('size') == st.st_size) and \
+               (record.get('mtime_ns') == st.st_mtime_ns) and \
+               (record.get('inode') == st.st_ino):
+                return True
+
+    hasher, _ = hash_file(path)
+    if hasher.hexdigest() == hash_:
+        record_verification(path, hash_, source=source)
+        return True
+    else:
+        sidecar.unlink(missing_ok=True)
+        return False
+
+
+def remove_unused_blobs(*images):
+    '''Remove stored layers that are not referenced by any cached image
+
+    References are collected from the tags of all images in the cache, and
+    from those of any additional image directory.
+    '''
+
+    required = set()
+    tags = glob.glob(str(Path(CACHE_DIR) / 'share/images/*/tags/*.json'))
+    for image in images:
+        tags += glob.glob(str(Path(image) / 'tags/*.json'))
+    for tag in tags:
+        with open(tag) as f:
+            required |= set(json.load(f)['layers'])
+
+    # Partial downloads are kept for some time, since their tag is only
+    # written once the download completes.
+    now = time.time()
+    for path in glob.glob(str(BLOBS_DIR / '*.tar*')):
+        path = Path(path)
+        hash_, suffix = path.name.split('.', 1)
+        if hash_ in required:
+            continue
+        if suffix in ('tar.gz.part', 'tar.gz.ranges'):
+            if now - path.stat().st_mtime < PARTIAL_TTL:
+                continue
+        debug('REMOVE', f'blobs/{path.name}')
+        path.unlink(missing_ok=True)
+
+    remove_unused_layers(required)
+
+
+def remove_unused_layers(required=None):
+    '''Remove unpacked layers that are not required
+
+    By default, unpacked layers are required if they are used by any extracted
+    image in the cache.
+    '''
+
+    if required is None:
+        required = set()
+        pattern = Path(CACHE_DIR) / 'share/images/*/extracted/*/.extracted'
+        for extracted in glob.glob(str(pattern)):
+            with open(extracted) as f:
+                required |= {line.split()[0] for line in f if line.strip()}
+
+    # Temporary layers are kept for some time, since they might be in use.
+    now = time.time()
+    for path in glob.glob(str(LAYERS_DIR / '*')):
+        path = Path(path)
+        hash_, suffix = path.name.partition('.')[::2]
+        if suffix in ('', 'json'):
+            if hash_ in required:
+                continue
+        elif now - path.stat().st_mtime < PARTIAL_TTL:
+            continue
+        debug('REMOVE', f'layers/{path.name}')
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+
+def _get_session():
+    '''Get the shared (keep-alive) HTTP session'''
+
+    global _session
+
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections = POOL_SIZE,
+                pool_maxsize = POOL_SIZE
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def _get_token(repository, *, refresh=False):
+    '''Get an authentication token for a registry repository'''
+
+    with _lock:
+        if not refresh:
+            try:
+                token, expires = _tokens[repository]
+            except KeyError:
+                pass
+            else:
+                if time.monotonic() < expires:
+                    return token
+
+    url = f'{REGISTRY_URL}/v2/auth'
+    url = f'{url}?service=quay.io&scope=repository:{repository}:pull'
+    debug('GET', url)
+    r = _get_session().request('GET', url)
+    if r.status_code == SUCCESS:
+        meta = r.json()
+        token = meta['token']
+        expires_in = meta.get('expires_in', 60)
+        expires = time.monotonic() + max(expires_in - TOKEN_MARGIN, 0)
+        with _lock:
+            _tokens[repository] = (token, expires)
+        return token
+    else:
+        raise DownloadError(r.status_code, r.text, r.headers)
+
+
 @dataclass(frozen=True)
 class Downloader:
 
@@ -34,6 +277,9 @@ class Downloader:
     '''Docker image.'''
     image: str = field(init=False)
 
+    '''Registry repository.'''
+    repository: str = field(init=False)
+
     '''Authentication token.'''
     token: str = field(init=False)
 
@@ -47,43 +293,97 @@ class Downloader:
         # Set image name.
         image = f'{self.tag}_{self.arch}'
         object.__setattr__(self, 'image', image)
+        object.__setattr__(self, 'repository', f'pypa/{image}')
 
 
     def default_destination(self):
         return Path(CACHE_DIR) / f'share/images/{self.image}'
 
 
+    def _migrate_layers(self, destination):
+        '''Move layers from a per-image cache to the shared store'''
+
+        legacy = destination / 'layers'
+        if not legacy.exists():
+            return
+
+        debug('MIGRATE', f'{self.image} [layers]')
+        BLOBS_DIR.mkdir(exist_ok=True, parents=True)
+        for path in legacy.iterdir():
+            target = BLOBS_DIR / path.name
+            if target.exists():
+                path.unlink()
+            else:
+                shutil.move(path, target)
+        legacy.rmdir()
+
+
     def download(
         self,
         destination: Optional[Path]=None,
         *,
-        tag: Optional[str] = 'latest'
+        tag: Optional[str] = 'latest',
+        jobs: int = 1,
+        consumer: Optional['LayerStream'] = None
         ):
-        '''Download Manylinux image'''
+        '''Download Manylinux image
+
+        If a *consumer* is provided (e.g. see ImageExtractor.stream), layers
+        are handed over to it as soon as they are available. In addition, the
+        body of the next layer expected by the consumer is streamed to it
+        while being downloaded.
+        '''
 
         destination = destination or self.default_destination()
+        self._migrate_layers(destination)
 
-        # Authenticate to quay.io.
-        repository = f'pypa/{self.image}'
-        log('PULL', f'{self.image}:{tag}')
-        url = 'https://quay.io/v2/auth'
-        url = f'{url}?service=quay.io&scope=repository:{repository}:pull'
-        debug('GET', url)
-        r = requests.request('GET', url)
-        if r.status_code == SUCCESS:
-            object.__setattr__(self, 'token', r.json()['token'])
+        # Check for a cached version of the image.
+        tag_file = destination / f'tags/{tag}.json'
+        if tag_file.exists():
+            with tag_file.open() as f:
+                meta = json.load(f)
+
+            def is_complete():
+                for hash_ in meta['layers']:
+                    path = BLOBS_DIR / f'{hash_}.tar.gz'
+                    if not path.exists() or not verify_layer(path, hash_):
+                        return False
+                return True
+
+            age = time.time() - meta.get('checked', 0)
+            if OFFLINE or (age < TAG_TTL):
+                if is_complete():
+                    debug('CACHED', f'{self.image}:{tag}')
+                    return
+                elif OFFLINE:
+                    raise DownloadError(
+                        f'missing layers for {self.image}:{tag} (offline)')
+        elif OFFLINE:
+            raise DownloadError(f'no cached image {self.image}:{tag} '
+                                 '(offline)')
         else:
-            raise DownloadError(r.status_code, r.text, r.headers)
+            meta = None
 
-        # Fetch image manifest.
-        repository = f'pypa/{self.image}'
-        url = f'https://quay.io/v2/{repository}/manifests/{tag}'
+        url = f'{REGISTRY_URL}/v2/{self.repository}/manifests/{tag}'
         headers = {
-            'Authorization': f'Bearer {self.token}',
             'Accept': 'application/vnd.docker.distribution.manifest.v2+json'
         }
-        debug('GET', url)
-        r = requests.request('GET', url, headers=headers)
+
+        # Compare the digest of the cached image with the remote one.
+        if meta is not None:
+            r = self._request('HEAD', url, headers=headers)
+            if r.status_code == SUCCESS:
+                digest = r.headers.get('Docker-Content-Digest', '')
+                digest = digest.split(':', 1)[-1]
+                if (digest == meta['digest']) and is_complete():
+                    debug('UPTODATE', f'{self.image}:{tag}')
+                    meta['checked'] = time.time()
+                    self._write_tag(tag_file, meta)
+                    return
+
+        # Fetch image manifest.
+        log('PULL', f'{self.image}:{tag}')
+        r = self._request('GET', url, headers=headers)
         if r.status_code == SUCCESS:
             image_digest = r.headers['Docker-Content-Digest'].split(':', 1)[-1]
             manifest = r.json()
@@ -93,75 +393,331 @@ class Downloader:
         # Check missing layers to download.
         required = [layer['digest'].split(':', 1)[-1] for layer in
                     manifest['layers']]
+        sizes = {layer['digest'].split(':', 1)[-1]: layer.get('size')
+                 for layer in manifest['layers']}
 
         missing = []
         for hash_ in required:
-            path = destination / f'layers/{hash_}.tar.gz'
-            if path.exists():
-                hasher = hashlib.sha256()
-                with path.open('rb') as f:
-                    while True:
-                        chunk = f.read(CHUNK_SIZE)
-                        if not chunk:
-                            break
-                        else:
-                            hasher.update(chunk)
-                    h = hasher.hexdigest()
-                    if h != hash_:
-                        missing.append(hash_)
-                    else:
-                        debug('FOUND', f'{hash_}.tar.gz')
+            path = BLOBS_DIR / f'{hash_}.tar.gz'
+            if path.exists() and verify_layer(path, hash_):
+                debug('FOUND', f'{hash_}.tar.gz')
             else:
                 missing.append(hash_)
 
         # Fetch missing layers.
-        with tempfile.TemporaryDirectory() as tmpdir:
-            workdir = Path(tmpdir)
-            for i, hash_ in enumerate(missing):
-                debug('DOWNLOAD', f'{self.image}:{tag} '
-                                  f'[{i + 1} / {len(missing)}]')
-
-                filename = f'{hash_}.tar.gz'
-                url = f'https://quay.io/v2/{repository}/blobs/sha256:{hash_}'
-                debug('GET', url)
-                r = requests.request('GET', url, headers=headers, stream=True)
-                if r.status_code == SUCCESS:
-                    debug('STREAM', filename)
+        layers_dir = BLOBS_DIR
+        layers_dir.mkdir(exist_ok=True, parents=True)
+
+        # The number of simultaneous connections is bounded by the number of
+        # jobs, whether these connections fetch distinct layers or distinct
+        # ranges of a same layer.
+        slots = threading.BoundedSemaphore(jobs) if jobs > 1 else None
+
+        def fetch(i, hash_):
+            debug('DOWNLOAD', f'{self.image}:{tag} '
+                              f'[{i + 1} / {len(missing)}]')
+            self._fetch_layer(hash_, layers_dir, size=sizes[hash_],
+                              jobs=jobs, slots=slots, consumer=consumer)
+
+        if consumer is not None:
+            consumer.start(required, missing)
+
+        try:
+            if jobs > 1 and len(missing) > 1:
+                with ThreadPoolExecutor(max_workers=jobs) as executor:
+                    futures = [executor.submit(fetch, i, hash_)
+                               for i, hash_ in enumerate(missing)]
+                    try:
+                        for future in as_completed(futures):
+                            future.result()
+                    except BaseException:
+                        for future in futures:
+                            future.cancel()
+                        raise
+            else:
+                for i, hash_ in enumerate(missing):
+                    fetch(i, hash_)
+        except BaseException:
+            if consumer is not None:
+                consumer.abort()
+            raise
+
+        self._write_tag(tag_file, {
+            'digest': image_digest,
+            'layers': required,
+            'checked': time.time()
+        })
+
+        if consumer is not None:
+            consumer.finish()
+
+        # Remove unused layers.
+        remove_unused_blobs(destination)
+
+
+    @staticmethod
+    def _write_tag(path, meta):
+        '''Write tag metadata to the cache (atomically)'''
+
+        path.parent.mkdir(exist_ok=True, parents=True)
+        tmp = path.with_name(f'{path.name}.tmp')
+        with tmp.open('w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+
+
+    def _request(self, method, url, *, headers=None, **kwargs):
+        '''Send an authenticated request to the registry
+
+        The request is sent over the shared HTTP session, using a cached token.
+        The token is renewed if it has expired, or if the request is rejected.
+        '''
+
+        for refresh in (False, True):
+            token = _get_token(self.repository, refresh=refresh)
+            object.__setattr__(self, 'token', token)
+            request_headers = {'Authorization': f'Bearer {token}'}
+            if headers:
+                request_headers.update(headers)
+            debug(method, url)
+            r = _get_session().request(method, url, headers=request_headers,
+                                       **kwargs)
+            if r.status_code != UNAUTHORIZED:
+                break
+            r.close()
+        return r
+
+
+    def _fetch_layer(self, hash_, layers_dir, *, size=None, jobs=1,
+                     slots=None, consumer=None):
+        '''Download a single layer and move it to the cache
+
+        The layer is streamed to a partial file, within the layers directory.
+        If the transfer is interrupted, the partial file is kept and the
+        download is resumed from its current size using a HTTP Range request.
+        Large layers are fetched as several byte ranges, over concurrent
+        connections.
+        '''
+
+        filename = f'{hash_}.tar.gz'
+        partial = layers_dir / f'{filename}.part'
+        ranges = layers_dir / f'{filename}.ranges'
+        url = f'{REGISTRY_URL}/v2/{self.repository}/blobs/sha256:{hash_}'
+
+        # Downloads started sequentially are resumed sequentially, and
+        # conversely.
+        if ranges.exists() or ((jobs > 1) and (size is not None) and \
+                               (size > SPLIT_SIZE) and not partial.exists()):
+            try:
+                self._fetch_ranges(url, hash_, size, layers_dir, jobs=jobs,
+                                   slots=slots)
+            except _RangeError:
+                debug('FALLBACK', f'{filename} [no range support]')
+                partial.unlink(missing_ok=True)
+                ranges.unlink(missing_ok=True)
+            else:
+                if consumer is not None:
+                    consumer.landed(hash_)
+                return
+
+        sink = consumer.feed(hash_) if consumer is not None else None
+        try:
+            with slots or nullcontext():
+                self._fetch_stream(url, hash_, layers_dir, sink=sink)
+        except BaseException:
+            if sink is not None:
+                sink.abort()
+            raise
+        else:
+            if sink is not None:
+                sink.close()
+            if consumer is not None:
+                consumer.landed(hash_)
+
+
+    def _fetch_stream(self, url, hash_, layers_dir, sink=None):
+        '''Download a layer as a single (resumable) stream
+
+        The layer content is also written to the *sink*, if any.
+        '''
+
+        filename = f'{hash_}.tar.gz'
+        partial = layers_dir / f'{filename}.part'
+
+        # Recover the hash state of any previous partial download.
+        if partial.exists():
+            hasher, offset = hash_file(partial)
+            debug('RESUME', f'{filename} [{offset} bytes]')
+            if sink is not None:
+                with partial.open('rb') as f:
+                    while True:
+                        chunk = f.read(BUFFER_SIZE)
+                        if not chunk:
+                            break
+                        sink.write(chunk)
+        else:
+            hasher, offset = hashlib.sha256(), 0
+
+        attempt = 0
+        while True:
+            headers = {}
+            if offset > 0:
+                headers['Range'] = f'bytes={offset}-'
+            try:
+                r = self._request('GET', url, headers=headers, stream=True)
+                if r.status_code == PARTIAL_CONTENT:
+                    mode = 'ab'
+                elif r.status_code == SUCCESS:
+                    # The range was not honoured. Restart from scratch.
+                    if (sink is not None) and (offset > 0):
+                        sink.abort()
+                        sink = None
+                    hasher = hashlib.sha256()
+                    offset = 0
+                    mode = 'wb'
+                elif r.status_code == RANGE_NOT_SATISFIABLE:
+                    # The partial file is inconsistent. Discard it.
+                    if sink is not None:
+                        sink.abort()
+                        sink = None
+                    partial.unlink()
+                    hasher = hashlib.sha256()
+                    offset = 0
+                    continue
                 else:
                     raise DownloadError(r.status_code, r.text, r.headers)
 
-                hasher = hashlib.sha256()
-                tmp = workdir / 'layer.tgz'
-                with open(tmp, "wb") as f:
+                debug('STREAM', filename)
+                with partial.open(mode) as f:
                     for chunk in r.iter_content(CHUNK_SIZE):
                         if chunk:
                             f.write(chunk)
                             hasher.update(chunk)
+                            offset += len(chunk)
+                            if sink is not None:
+                                sink.write(chunk)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > RETRIES:
+                    raise DownloadError(f'could not download {filename} '
+                                        f'({e})') from e
+                debug('RETRY', f'{filename} from byte {offset} '
+                               f'[{attempt} / {RETRIES}]')
+                time.sleep(attempt)
+                continue
+            else:
+                break
 
-                    h = hasher.hexdigest()
-                    if h != hash_:
-                        raise DownloadError(
-                            f'bad hash (expected {hash_}, found {h})'
-                        )
-                layers_dir = destination / 'layers'
-                layers_dir.mkdir(exist_ok=True, parents=True)
-                shutil.move(tmp, layers_dir / filename)
+        h = hasher.hexdigest()
+        if h != hash_:
+            partial.unlink()
+            raise DownloadError(
+                f'bad hash (expected {hash_}, found {h})'
+            )
 
-        tags_dir = destination / 'tags'
-        tags_dir.mkdir(exist_ok=True, parents=True)
-        with open(tags_dir / f'{tag}.json', "w") as f:
-            json.dump({'digest': image_digest, 'layers': required}, f)
+        os.replace(partial, layers_dir / filename)
+        record_verification(layers_dir / filename, hash_)
 
-        # Remove unused layers.
-        required = set(required)
-        for tag in glob.glob(str(destination / 'tags/*.json')):
-            with open(tag) as f:
-                tag = json.load(f)
-                required |= set(tag["layers"])
-        required = [f'{hash_}.tar.gz' for hash_ in required]
-
-        for layer in glob.glob(str(destination / 'layers/*.tar.gz')):
-            layer = Path(layer)
-            if layer.name not in required:
-                debug('REMOVE', f'{self.image} [layer/{layer.stem}]')
-                layer.unlink()
+
+    def _fetch_ranges(self, url, hash_, size, layers_dir, *, jobs=1,
+                      slots=None):
+        '''Download a layer as byte ranges, into a preallocated file
+
+        Completed ranges are recorded in a sidecar file, such that an
+        interrupted download can be resumed.
+        '''
+
+        filename = f'{hash_}.tar.gz'
+        partial = layers_dir / f'{filename}.part'
+        ranges = layers_dir / f'{filename}.ranges'
+
+        if size is None:
+            raise _RangeError()
+
+        done = set()
+        if ranges.exists() and partial.exists():
+            with ranges.open() as f:
+                meta = json.load(f)
+            if meta['size'] == size:
+                done = set(meta['done'])
+
+        if not done:
+            with partial.open('wb') as f:
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except (AttributeError, OSError):
+                    f.truncate(size)
+
+        starts = [start for start in range(0, size, RANGE_SIZE)
+                  if start not in done]
+        debug('SPLIT', f'{filename} [{len(starts)} ranges]')
+        lock = threading.Lock()
+
+        def record(start):
+            with lock:
+                done.add(start)
+                tmp = ranges.with_suffix('.tmp')
+                with tmp.open('w') as f:
+                    json.dump({'size': size, 'done': sorted(done)}, f)
+                os.replace(tmp, ranges)
+
+        def fetch(fd, start):
+            end = min(start + RANGE_SIZE, size) - 1
+            position = start
+            attempt = 0
+            while position <= end:
+                headers = {'Range': f'bytes={position}-{end}'}
+                try:
+                    with slots or nullcontext():
+                        r = self._request('GET', url, headers=headers,
+                                          stream=True)
+                        if r.status_code == SUCCESS:
+                            r.close()
+                            raise _RangeError()
+                        elif r.status_code != PARTIAL_CONTENT:
+                            raise DownloadError(r.status_code, r.text,
+                                                r.headers)
+                        for chunk in r.iter_content(CHUNK_SIZE):
+                            if chunk:
+                                chunk = chunk[:end + 1 - position]
+                                os.pwrite(fd, chunk, position)
+                                position += len(chunk)
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.ChunkedEncodingError) as e:
+                    attempt += 1
+                    if attempt > RETRIES:
+                        raise DownloadError(f'could not download {filename} '
+                                            f'({e})') from e
+                    debug('RETRY', f'{filename} from byte {position} '
+                                   f'[{attempt} / {RETRIES}]')
+                    time.sleep(attempt)
+            record(start)
+
+        fd = os.open(partial, os.O_WRONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(fetch, fd, start)
+                           for start in starts]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            os.close(fd)
+
+        hasher, _ = hash_file(partial)
+        h = hasher.hexdigest()
+        if h != hash_:
+            partial.unlink()
+            ranges.unlink(missing_ok=True)
+            raise DownloadError(
+                f'bad hash (expected {hash_}, found {h})'
+            )
+
+        os.replace(partial, layers_dir / filename)
+        ranges.unlink(missing_ok=True)
+        record_verification(layers_dir / filename, hash_)
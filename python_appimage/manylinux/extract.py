@@ -1,6 +1,8 @@
 import atexit
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from distutils.version import LooseVersion
+import functools
 import glob
 import json
 import os
@@ -8,16 +10,36 @@ import re
 from pathlib import Path
 import shutil
 import stat
-import subprocess
-from typing import Dict, List, Optional
+import tarfile
+import threading
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 from .config import Arch, PythonImpl, PythonVersion
+from .download import BLOBS_DIR, LAYERS_DIR
+from .index import ImageIndex
+from .unpack import BUFFER_SIZE, check_layer, compose_layer, load_members, \
+                     Member, plan_layers, resolve_member, save_members, \
+                     Selection, unpack_layer
+from .transcode import layer_path, open_layer
+from .view import DirectoryView, LayersView
 from ..appimage import Appifier
-from ..utils.deps import ensure_excludelist, ensure_patchelf, EXCLUDELIST, \
-                         PATCHELF
+from ..appimage.prune import is_pruned, MANYLINUX_PRUNED
+from ..utils.deps import ensure_excludelist, EXCLUDELIST
+from ..utils.elf import read_elf, set_rpath
 from ..utils.log import debug, log
 
 
+INTERNAL_LIBRARIES = ('curl-*', 'mpdecimal-*', 'openssl-*', 'sqlite*')
+'''Libraries installed under opt/_internal.'''
+
+LIBRARY_DIRS = ('lib', 'lib64', 'lib/*-linux-gnu', 'usr/lib', 'usr/lib64',
+                'usr/lib/*-linux-gnu', 'usr/local/lib')
+'''System libraries locations (for all architectures).'''
+
+TCLTK_LOCATIONS = ('usr/local/lib', 'usr/share', 'usr/share/tcltk')
+'''Tcl/Tk data locations.'''
+
+
 @dataclass(frozen=True)
 class PythonExtractor:
     '''Python extractor from an extracted Manylinux image.'''
@@ -36,11 +58,30 @@ class PythonExtractor:
     '''Exclude list for shared libraries.'''
 
     patchelf: Optional[Path] = None
-    '''Patchelf executable.'''
+    '''Patchelf executable (by default, downloaded if needed).'''
+
+    image_extractor: Optional['ImageExtractor'] = None
+    '''Image extractor, for extracting missing files on demand.'''
+
+    view: Optional[Union[DirectoryView, LayersView]] = None
+    '''Image view (by default, the extracted image at prefix).'''
+
+    index: Optional[ImageIndex] = None
+    '''Image content index, for looking up entries without probing the view.
+    '''
+
+    excluded: Optional[Set[str]] = None
+    '''Excluded shared libraries (by default, read from the exclude list).'''
+
+    libraries: Dict[str, Path] = field(default_factory=dict, repr=False)
+    '''Located libraries (cache, possibly shared with other extractors)'''
 
+    needed: Dict[Path, Tuple[str, ...]] = field(default_factory=dict,
+                                                repr=False)
+    '''Libraries required by binaries (cache, possibly shared with other
+    extractors)
+    '''
 
-    excluded: List[str] = field(init=False)
-    '''Excluded shared libraries.'''
 
     impl: PythonImpl = field(init=False)
     '''Python implementation'''
@@ -56,8 +97,11 @@ class PythonExtractor:
 
 
     def __post_init__(self):
+        if self.view is None:
+            object.__setattr__(self, 'view', DirectoryView(self.prefix))
+
         # Locate Python installation.
-        link = os.readlink(self.prefix / f'opt/python/{self.tag}')
+        link = self.view.readlink(self.prefix / f'opt/python/{self.tag}')
         if not link.startswith('/'):
             raise NotImplementedError()
         object.__setattr__(self, 'python_prefix', self.prefix / link[1:])
@@ -92,39 +136,32 @@ class PythonExtractor:
             raise NotImplementedError()
         paths.append(self.prefix / 'usr/local/lib')
 
-        patterns = (
-            'curl-*',
-            'mpdecimal-*',
-            'openssl-*',
-            'sqlite*',
-        )
-        for pattern in patterns:
-            pattern = str(self.prefix / f'opt/_internal/{pattern}/lib')
-            for match in glob.glob(pattern):
+        lookup = self.view if self.index is None else self.index
+        for pattern in INTERNAL_LIBRARIES:
+            pattern = self.prefix / f'opt/_internal/{pattern}/lib'
+            for match in lookup.glob(pattern):
                 paths.append(Path(match))
 
         object.__setattr__(self, 'library_path', paths)
 
         # Set excluded libraries.
-        if self.excludelist:
-            excludelist = Path(self.excludelist)
-        else:
-            ensure_excludelist()
-            excludelist = Path(EXCLUDELIST)
-        excluded = set()
-        with excludelist.open() as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    excluded.add(line)
-        excluded.add('ld-linux-aarch64.so.1')  # patch for aarch64.
-        object.__setattr__(self, 'excluded', excluded)
-
-        # Set patchelf, if not provided.
-        if self.patchelf is None:
-            ensure_patchelf()
-            object.__setattr__(self, 'patchelf', PATCHELF)
-        else:
+        if self.excluded is None:
+            if self.excludelist:
+                excludelist = Path(self.excludelist)
+            else:
+                ensure_excludelist()
+                excludelist = Path(EXCLUDELIST)
+            excluded = set()
+            with excludelist.open() as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        excluded.add(line)
+            excluded.add('ld-linux-aarch64.so.1')  # patch for aarch64.
+            object.__setattr__(self, 'excluded', excluded)
+
+        # Check patchelf, if provided.
+        if self.patchelf is not None:
             assert(self.patchelf.exists())
 
 
@@ -154,7 +191,7 @@ class PythonExtractor:
         system_dest = destination / system_prefix
 
         # Locate include files.
-        include = glob.glob(str(self.python_prefix / 'include/*'))
+        include = self.view.glob(self.python_prefix / 'include/*')
         if include:
             include = Path(include[0]).name
             include = f'include/{include}'
@@ -165,12 +202,11 @@ class PythonExtractor:
         log('CLONE',
             f'{python} from {self.python_prefix.relative_to(self.prefix)}')
         (python_dest / 'bin').mkdir(exist_ok=True, parents=True)
-        shutil.copy(self.python_prefix / runtime, python_dest / runtime)
+        self.view.copy(self.python_prefix / runtime, python_dest / runtime)
 
         # Clone pip wrapper.
-        with open(self.python_prefix / pip) as f:
-            f.readline() # Skip shebang.
-            body = f.read()
+        content = self.view.read_bytes(self.python_prefix / pip).decode()
+        body = content.split('\n', 1)[1] # Skip shebang.
 
         with open(python_dest / pip, 'w') as f:
             f.write('#! /bin/sh\n')
@@ -181,30 +217,21 @@ class PythonExtractor:
                 '"$@"\n'
             )))
             f.write(body)
-        shutil.copymode(self.python_prefix / pip, python_dest / pip)
-
-        # Clone Python packages.
-        for folder in (packages, include):
-            shutil.copytree(self.python_prefix / folder, python_dest / folder,
-                            symlinks=True, dirs_exist_ok=True)
-
-        # Remove some clutters.
-        log('PRUNE', '%s packages', python)
-        shutil.rmtree(python_dest / packages / 'test', ignore_errors=True)
-        for root, dirs, files in os.walk(python_dest / packages):
-            root = Path(root)
-            for d in dirs:
-                if d == '__pycache__':
-                    shutil.rmtree(root / d, ignore_errors=True)
-            for f in files:
-                if f.endswith('.pyc'):
-                    (root / f).unlink()
+        mode = self.view.mode(self.python_prefix / pip)
+        (python_dest / pip).chmod(stat.S_IMODE(mode))
+
+        # Clone Python packages, pruning some clutters.
+        self.view.copytree(self.python_prefix / packages,
+                           python_dest / packages, dirs_exist_ok=True,
+                           ignore=_is_pruned)
+        self.view.copytree(self.python_prefix / include,
+                           python_dest / include, dirs_exist_ok=True)
 
         # Map binary dependencies.
         libs = self.ldd(self.python_prefix / f'bin/{flavoured_python}')
         path = Path(self.python_prefix / f'{packages}/lib-dynload')
-        for module in glob.glob(str(path / "*.so")):
-            l = self.ldd(module)
+        for module in self.view.glob(path / "*.so"):
+            l = self.ldd(Path(module))
             libs.update(l)
 
         # Copy and patch binary dependencies.
@@ -213,7 +240,7 @@ class PythonExtractor:
 
         for (name, src) in libs.items():
             dst = libdir / name
-            shutil.copy(src, dst, follow_symlinks=True)
+            self.view.copy(src, dst)
             # Some libraries are read-only, which prevents overriding the
             # destination directory. Below, we change the permission of
             # destination files to read-write (for the owner).
@@ -239,45 +266,37 @@ class PythonExtractor:
 
         # Copy SSL certificates (i.e. clone certifi).
         certs = self.prefix / 'opt/_internal/certs.pem'
-        if certs.is_symlink():
-            dst = self.prefix / str(certs.readlink())[1:]
+        if self.view.is_symlink(certs):
+            dst = self.prefix / self.view.readlink(certs)[1:]
             certifi = dst.parent
             assert(certifi.name == 'certifi')
             site_packages = certifi.parent
             assert(site_packages.name == 'site-packages')
             log('INSTALL', certifi.name)
 
-            matches = [
-                Path(src) for src in glob.glob(str(site_packages / 'certifi*'))
-            ]
-            matches = sorted(matches, key=lambda src: src.name)
-            cert_src = None
-            for src in matches:
+            if self.image_extractor is not None:
+                pattern = site_packages.relative_to(self.prefix) / 'certifi*'
+                if not self.view.glob(site_packages / 'certifi*'):
+                    self.image_extractor.materialize([str(pattern)],
+                                                     self.prefix)
+
+            for src in self.view.glob(site_packages / 'certifi*'):
+                src = Path(src)
                 dst = python_dest / f'{packages}/site-packages/{src.name}'
                 if not dst.exists():
-                    shutil.copytree(src, dst, symlinks=True)
-                if cert_src is None:
-                    cacert_pem = dst / 'cacert.pem'
-                    if cacert_pem.exists():
-                        cert_src = cacert_pem
-            assert(cert_src is not None)
+                    self.view.copytree(src, dst)
+            assert(self._cert_src(python_dest / packages) is not None)
         else:
             raise NotImplementedError()
 
         # Copy Tcl & Tk data.
-        tx_version = []
-        for match in glob.glob(str(system_dest / 'lib/libtk*')):
-            path = system_dest / f'lib/{match}'
-            tx_version.append(LooseVersion(path.name[5:8]))
-
+        tx_version = self._tk_version(system_dest)
         if tx_version:
-            tx_version.sort()
-            tx_version = tx_version[-1]
-
-            for location in ('usr/local/lib', 'usr/share', 'usr/share/tcltk'):
+            lookup = self.view if self.index is None else self.index
+            for location in TCLTK_LOCATIONS:
                 tcltk_src = self.prefix / location
                 path = tcltk_src / f'tk{tx_version}'
-                if path.exists() and path.is_dir():
+                if lookup.is_dir(path):
                     break
             else:
                 raise ValueError(f'could not locate Tcl/Tk{tx_version}')
@@ -290,37 +309,71 @@ class PythonExtractor:
                 name = f'{tx}{tx_version}'
                 src = tcltk_src / name
                 dst = tcltk_dir / name
-                shutil.copytree(src, dst, symlinks=True, dirs_exist_ok=True)
+                self.view.copytree(src, dst, dirs_exist_ok=True)
 
         if appify:
-            appifier = Appifier(
-                appdir = str(destination),
-                appdir_bin = str(system_dest / 'bin'),
-                python_bin = str(python_dest / 'bin'),
-                python_pkg = str(python_dest / packages),
-                version = self.version,
-                tk_version = tx_version,
-                cert_src = cert_src
-            )
-            appifier.appify()
+            self.appify(destination, python_prefix=python_prefix,
+                        system_prefix=system_prefix)
+
+
+    def appify(
+        self,
+        destination: Path,
+        *,
+        python_prefix: Optional[str]=None,
+        system_prefix: Optional[str]=None,
+        ):
+        '''Bundle AppImage specific files with an extracted Python runtime.'''
+
+        flavoured_python = f'python{self.version.flavoured()}'
+        packages = f'lib/{flavoured_python}'
+
+        if python_prefix is None:
+            python_prefix = f'opt/{flavoured_python}'
+
+        if system_prefix is None:
+            system_prefix = 'usr'
+
+        python_dest = destination / python_prefix
+        system_dest = destination / system_prefix
+
+        appifier = Appifier(
+            appdir = str(destination),
+            appdir_bin = str(system_dest / 'bin'),
+            python_bin = str(python_dest / 'bin'),
+            python_pkg = str(python_dest / packages),
+            version = self.version,
+            tk_version = self._tk_version(system_dest),
+            cert_src = self._cert_src(python_dest / packages)
+        )
+        appifier.appify()
 
 
     def ldd(self, target: Path) -> Dict[str, Path]:
-        '''Cross-platform implementation of ldd, using readelf.'''
+        '''Cross-platform implementation of ldd, reading ELF files in-process.
+
+        Binaries are read, and libraries located, only once per extractor.
+        '''
 
-        pattern = re.compile(r'[(]NEEDED[)]\s+Shared library:\s+\[([^\]]+)\]')
         dependencies = dict()
 
         def recurse(target: Path):
-            result = subprocess.run(f'readelf -d {target}', shell=True,
-                                    check=True, capture_output=True)
-            stdout = result.stdout.decode()
-            matches = pattern.findall(stdout)
-
-            for match in matches:
-                if (match not in dependencies) and (match not in self.excluded):
-                    path = self.locate_library(match)
-                    dependencies[match] = path
+            needed = self.needed.get(target)
+            if needed is None:
+                # Temporary copies (from layers views) are not worth caching
+                # on disk.
+                cache = not isinstance(self.view, LayersView)
+                with self.view.local(target) as path:
+                    needed = read_elf(path, cache=cache).needed
+                self.needed[target] = needed
+
+            for name in needed:
+                if (name not in dependencies) and (name not in self.excluded):
+                    path = self.libraries.get(name)
+                    if path is None:
+                        path = self.locate_library(name)
+                        self.libraries[name] = path
+                    dependencies[name] = path
                     recurse(path)
 
         recurse(target)
@@ -330,22 +383,67 @@ class PythonExtractor:
     def locate_library(self, name: str) -> Path:
         '''Locate a library given its qualified name.'''
 
+        if self.index is not None:
+            dirnames = self.index.libraries(name)
+            for dirname in self.library_path:
+                path = dirname / name
+                if (self.index.resolve(dirname) in dirnames) and \
+                   self.index.exists(path):
+                    break
+            else:
+                raise FileNotFoundError(name)
+
+            if (self.image_extractor is not None) and \
+               not self.view.exists(path):
+                # The library might not have been selected for extraction.
+                pattern = str(path.relative_to(self.prefix))
+                self.image_extractor.materialize([pattern], self.prefix)
+            return path
+
         for dirname in self.library_path:
             path = dirname / name
-            if path.exists():
+            if self.view.exists(path):
                 return path
-        else:
-            raise FileNotFoundError(name)
+
+        if self.image_extractor is not None:
+            # The library might not have been selected for extraction.
+            patterns = [str((dirname / name).relative_to(self.prefix))
+                        for dirname in self.library_path]
+            if self.image_extractor.materialize(patterns, self.prefix):
+                for dirname in self.library_path:
+                    path = dirname / name
+                    if self.view.exists(path):
+                        return path
+
+        raise FileNotFoundError(name)
 
 
     def set_rpath(self, target, rpath):
-        cmd = f'{self.patchelf} --print-rpath {target}'
-        result = subprocess.run(cmd, shell=True, check=True,
-                                capture_output=True)
-        current_rpath = result.stdout.decode().strip()
-        if current_rpath != rpath:
-            cmd = f"{self.patchelf} --set-rpath '{rpath}' {target}"
-            subprocess.run(cmd, shell=True, check=True, capture_output=True)
+        set_rpath(target, rpath, patchelf=self.patchelf)
+
+
+    @staticmethod
+    def _cert_src(packages: Path) -> Optional[Path]:
+        '''Locate the bundled SSL certificates (from certifi).'''
+
+        matches = sorted(glob.glob(str(packages / 'site-packages/certifi*')))
+        for match in matches:
+            cacert_pem = Path(match) / 'cacert.pem'
+            if cacert_pem.exists():
+                return cacert_pem
+
+
+    @staticmethod
+    def _tk_version(system_dest: Path) -> Union[LooseVersion, list]:
+        '''Get the version of the bundled Tk library, if any.'''
+
+        tx_version = []
+        for match in glob.glob(str(system_dest / 'lib/libtk*')):
+            tx_version.append(LooseVersion(Path(match).name[5:8]))
+        if tx_version:
+            tx_version.sort()
+            return tx_version[-1]
+        return tx_version
 
 
 @dataclass(frozen=True)
@@ -358,13 +456,25 @@ class ImageExtractor:
     tag: Optional[str] = 'latest'
     '''Manylinux image tag.'''
 
+    abi: Optional[str] = None
+    '''Python binary tag, for extracting only the files that it requires.'''
+
 
     def default_destination(self):
-        return self.prefix / f'extracted/{self.tag}'
+        if self.abi is None:
+            return self.prefix / f'extracted/{self.tag}'
+        else:
+            return self.prefix / f'extracted/{self.tag}@{self.abi}'
+
 
+    def extract(self, destination: Optional[Path]=None, *, clean=False,
+                jobs=1):
+        '''Extract Manylinux image.
 
-    def extract(self, destination: Optional[Path]=None, *, clean=False):
-        '''Extract Manylinux image.'''
+        With multiple jobs, layers are first unpacked concurrently, in
+        separate processes, to the shared layers store. They are then
+        composed in order.
+        '''
 
         if destination is None:
             destination = self.default_destination()
@@ -374,45 +484,564 @@ class ImageExtractor:
                 shutil.rmtree(destination, ignore_errors=True)
             atexit.register(clean, destination)
 
-        log('EXTRACT', f'{self.prefix.name}:{self.tag}')
+        if self.abi is None:
+            log('EXTRACT', f'{self.prefix.name}:{self.tag}')
+        else:
+            log('EXTRACT', f'{self.prefix.name}:{self.tag} [{self.abi}]')
 
         with open(self.prefix / f'tags/{self.tag}.json') as f:
             meta = json.load(f)
         layers = meta['layers']
 
+        pending = self._prepare(destination, layers)
+        if jobs > 1:
+            self._unpack_layers(pending, jobs)
+        plans = self._plan(pending)
+        for layer in pending:
+            self._extract_layer(destination, layer, skip=plans[layer])
+
+
+    def materialize(
+        self,
+        patterns: List[str],
+        destination: Optional[Path]=None,
+        ) -> bool:
+        '''Extract entries missing from a selective extraction, on demand.
+
+        Patterns are given relative to the image root. Return True if any
+        matching entry was extracted.
+        '''
+
+        if destination is None:
+            destination = self.default_destination()
+
+        with open(self.prefix / f'tags/{self.tag}.json') as f:
+            meta = json.load(f)
+        layers = meta['layers']
+        tables = self._tables(layers)
+        if any(table is None for table in tables):
+            return False
+
+        index = {}
+        for table in tables:
+            for member in table:
+                if member.kind not in ('w', 'o'):
+                    index[member.name] = member
+        selection = Selection(resolve_member(index, pattern)
+                              for pattern in patterns)
+
+        found = False
+        for layer, table, skip in zip(layers, tables, plan_layers(tables)):
+            wanted = [member for member in table if
+                      (member.kind not in ('w', 'o')) and
+                      (member.name not in skip) and selection(member.name)]
+            if not wanted:
+                continue
+
+            # Hardlinks require their target.
+            names = {member.name for member in wanted}
+            names.update(member.linkname for member in wanted
+                         if member.kind == 'h')
+
+            debug('EXTRACT', f'{len(names)} entries from {layer}.tar.gz')
+            self._unpack(layer, Selection(sorted(names)))
+            compose_layer(LAYERS_DIR / layer, table, destination, skip=skip,
+                          select=lambda member: member.name in names,
+                          whiteouts=False)
+            found = True
+
+        return found
+
+
+    def index(self, patches: Optional[List[Path]]=None) -> ImageIndex:
+        '''Get the content index of the image, building it if needed.
+
+        Patches (tarballs) are applied over the image layers.
+        '''
+
+        with open(self.prefix / f'tags/{self.tag}.json') as f:
+            meta = json.load(f)
+        sources = meta['layers'] + [patch.name for patch in patches or []]
+        path = self.prefix / f'extracted/{self.tag}.sqlite'
+        root = self.default_destination()
+
+        index = ImageIndex.load(path, root, sources)
+        if index is None:
+            view = self.view(patches)
+            try:
+                index = ImageIndex.build(path, root, view, sources)
+            finally:
+                view.close()
+        return index
+
+
+    def view(self, patches: Optional[List[Path]]=None) -> LayersView:
+        '''Get a read-only view of the image, without extracting it.
+
+        Patches (tarballs) are applied over the image layers.
+        '''
+
+        with open(self.prefix / f'tags/{self.tag}.json') as f:
+            meta = json.load(f)
+        layers = [layer_path(layer) for layer in meta['layers']]
+        if patches:
+            layers += patches
+        return LayersView(self.default_destination(), layers)
+
+
+    def stream(self, destination: Optional[Path]=None) -> 'LayerStream':
+        '''Get a consumer extracting layers while they are downloaded.'''
+
+        if destination is None:
+            destination = self.default_destination()
+        return LayerStream(self, destination)
+
+
+    def _prepare(self, destination: Path, layers: List[str]) -> List[str]:
+        '''Get the layers that remain to be extracted.
+
+        The destination is cleaned if previously extracted layers do not match
+        the requested ones. A layer whose extraction was interrupted is
+        extracted again, over the existing tree.
+        '''
+
         extracted = []
-        extracted_file = destination / '.extracted'
         if destination.exists():
-            clean_destination = True
-            if extracted_file.exists():
-                with extracted_file.open() as f:
-                    extracted = f.read().split(os.linesep)[:-1]
-
-                for a, b in zip(layers, extracted):
-                    if a != b:
+            journal = _read_journal(destination / '.extracted')
+            extracted = [layer for layer, _ in journal]
+            if layers[:len(extracted)] != extracted:
+                shutil.rmtree(destination, ignore_errors=True)
+                extracted = []
+            else:
+                for i, (layer, state) in enumerate(journal):
+                    if state != 'verified':
+                        log('RECOVER', f'{layer}.tar.gz [{state}]')
+                        extracted = extracted[:i]
                         break
+
+        return layers[len(extracted):]
+
+
+    def _plan(self, layers: List[str]) -> Dict[str, Set[str]]:
+        '''Get the entries of each layer that are overwritten by later ones.
+
+        Only layers whose members table is known (i.e. which were previously
+        extracted) can be planned.
+        '''
+
+        return dict(zip(layers, plan_layers(self._tables(layers))))
+
+
+    def _tables(self, layers: List[str]) -> List[Optional[List[Member]]]:
+        '''Get the members tables of layers (None if unknown).'''
+
+        return [load_members(BLOBS_DIR / f'{layer}.tar.gz.members')
+                for layer in layers]
+
+
+    def _unpack_layers(self, layers: List[str], jobs: int):
+        '''Unpack layers concurrently, to the shared layers store.'''
+
+        selection = None if self.abi is None else _python_selection(self.abi)
+        layers = [layer for layer in layers
+                  if self._unpacked(layer, selection) is None]
+        if len(layers) < 2:
+            return
+
+        debug('UNPACK', f'{len(layers)} layers [{jobs} jobs]')
+        with ProcessPoolExecutor(max_workers=min(jobs, len(layers))) \
+             as executor:
+            futures = [executor.submit(self._unpack, layer, selection)
+                       for layer in layers]
+            for layer, future in zip(layers, futures):
+                try:
+                    future.result()
+                except (OSError, tarfile.TarError) as e:
+                    raise ValueError(f'could not extract {layer}.tar.gz ({e})')
+
+
+    def _unpacked(
+        self,
+        layer: str,
+        selection: Optional[Selection]=None,
+        ) -> Optional[List[Member]]:
+        '''Get the members table of an unpacked layer.
+
+        None is returned if the selected entries have not all been unpacked.
+        '''
+
+        try:
+            with (LAYERS_DIR / f'{layer}.json').open() as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        table = self._tables([layer])[0]
+
+        previous = set(record['patterns'])
+        if (table is not None) and (record['complete'] or \
+           ((selection is not None) and previous and
+            previous.issuperset(selection.patterns))):
+            return table
+        else:
+            return None
+
+
+    def _extract_layer(
+        self,
+        destination: Path,
+        layer: str,
+        *,
+        skip: Optional[Set[str]]=None,
+        stream: Optional['_LayerPipe']=None,
+        ):
+        '''Extract a single layer, from the cache or from a stream.'''
+
+        debug('EXTRACT', f'{layer}.tar.gz')
+        journal = destination / '.extracted'
+        selection = None if self.abi is None else _python_selection(self.abi)
+        select = _selector(selection)
+        try:
+            # On failure, the layer remains in progress. It is composed again
+            # by the next extraction.
+            destination.mkdir(parents=True, exist_ok=True)
+            _write_journal(journal, layer, 'started')
+            table = self._unpack(layer, selection, stream=stream)
+            compose_layer(LAYERS_DIR / layer, table, destination, skip=skip,
+                          select=select)
+            _write_journal(journal, layer, 'complete')
+        except (OSError, tarfile.TarError) as e:
+            raise ValueError(f'could not extract {layer}.tar.gz ({e})')
+
+        mismatches = check_layer(table, destination, skip=skip, select=select)
+        if mismatches:
+            raise ValueError(f'could not verify {layer}.tar.gz extraction '
+                             f'({mismatches[0]})')
+        _write_journal(journal, layer, 'verified')
+
+
+    def _unpack(
+        self,
+        layer: str,
+        selection: Optional[Selection]=None,
+        *,
+        stream: Optional['_LayerPipe']=None,
+        ) -> List[Member]:
+        '''Unpack a layer on its own, to the shared layers store.
+
+        Unpacked layers are immutable, and composed into images. Only entries
+        that are selected and were not previously unpacked are written. The
+        layer members table is returned.
+        '''
+
+        path = LAYERS_DIR / layer
+        record_path = LAYERS_DIR / f'{layer}.json'
+        table = self._unpacked(layer, selection)
+        if table is not None:
+            if stream is not None:
+                # Consume the stream, not to block the downloader.
+                with os.fdopen(stream.fileno(), 'rb', closefd=False) as f:
+                    while f.read(BUFFER_SIZE):
+                        pass
+            return table
+
+        try:
+            with record_path.open() as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            record = {'complete': False, 'patterns': []}
+        previous = set(record['patterns'])
+
+        if selection is None:
+            target = LAYERS_DIR / f'{layer}.{os.getpid()}'
+            shutil.rmtree(target, ignore_errors=True)
+            select = None
+        else:
+            target = path
+            unpacked = Selection(previous)
+            def select(member):
+                if member.kind == 'l':
+                    # Links are always unpacked, when selecting entries.
+                    return not previous
                 else:
-                    clean_destination = False
+                    return selection(member.name) and \
+                           not unpacked(member.name)
+
+        try:
+            if stream is None:
+                with open_layer(layer_path(layer)) as (f, compression):
+                    table = unpack_layer(f, target, select=select,
+                                         whiteouts=False,
+                                         compression=compression)
+            else:
+                with os.fdopen(stream.fileno(), 'rb', closefd=False) as f:
+                    table = unpack_layer(f, target, select=select,
+                                         whiteouts=False)
+                    # Drain any trailing data, not to block the downloader.
+                    while f.read(BUFFER_SIZE):
+                        pass
+                if not stream.committed:
+                    raise ValueError(f'could not verify {layer}.tar.gz')
+        except BaseException:
+            shutil.rmtree(target, ignore_errors=True)
+            record_path.unlink(missing_ok=True)
+            raise
+
+        if selection is None:
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(target, path)
+            record = {'complete': True, 'patterns': []}
+        else:
+            record['patterns'] = sorted(previous | set(selection.patterns))
 
-            if clean_destination:
-                shutil.rmtree(destination, ignore_errors=True)
+        save_members(BLOBS_DIR / f'{layer}.tar.gz.members', table)
+        _dump_json(record_path, record)
+        return table
 
-        for i, layer in enumerate(layers):
-            try:
-                if layer == extracted[i]:
+
+def _dump_json(path: Path, data):
+    '''Write a JSON file atomically.'''
+
+    tmp = path.with_name(f'{path.name}.{os.getpid()}')
+    with tmp.open('w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_journal(path: Path) -> List[List[str]]:
+    '''Read the extraction journal of an image, as ordered layer states.
+
+    Journal lines are layer ids followed by their state (started, complete or
+    verified). Lines without a state, from older extractions, stand for
+    verified layers.
+    '''
+
+    journal = []
+    try:
+        with path.open() as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
                     continue
-            except IndexError:
-                pass
-
-            debug('EXTRACT', f'{layer}.tar.gz')
-            filename = self.prefix / f'layers/{layer}.tar.gz'
-            cmd = ''.join((
-                 f'trap \'chmod u+rw -R {destination}\' EXIT ; ',
-                 f'mkdir -p {destination} && ',
-                 f'tar -xzf {filename} --exclude=dev -C {destination} && ',
-                 f'echo \'{layer}\' >> {extracted_file}'
-            ))
-            r = subprocess.run(f'/bin/bash -c "{cmd}"', shell=True,
-                               capture_output=True)
-            if r.returncode != 0:
-                raise ValueError(r.stderr.decode())
+                layer = fields[0]
+                state = fields[1] if len(fields) > 1 else 'verified'
+                if journal and (journal[-1][0] == layer) and \
+                   (journal[-1][1] != 'verified'):
+                    journal[-1][1] = state
+                else:
+                    journal.append([layer, state])
+    except FileNotFoundError:
+        pass
+    return journal
+
+
+def _write_journal(path: Path, layer: str, state: str):
+    '''Record the extraction state of a layer, durably.'''
+
+    with path.open('a') as f:
+        f.write(f'{layer} {state}{os.linesep}')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+@functools.lru_cache()
+def _python_selection(abi: str) -> Selection:
+    '''Select the image entries that are required by a Python binary tag.'''
+
+    m = re.match(r'cp(\d)(\d+)-', abi)
+    if m is None:
+        python = 'opt/_internal'
+    else:
+        python = f'opt/_internal/cpython-{m.group(1)}.{m.group(2)}.*'
+
+    patterns = [python]
+    patterns += [f'opt/_internal/{pattern}/lib'
+                 for pattern in INTERNAL_LIBRARIES]
+    patterns += [f'{dirname}/*.so*' for dirname in LIBRARY_DIRS]
+    patterns += [f'{location}/{tx}*' for location in TCLTK_LOCATIONS
+                 for tx in ('tcl', 'tk')]
+    return Selection(patterns)
+
+
+def _is_pruned(relpath: str) -> bool:
+    '''Check if a path of Python packages is pruned.'''
+    return is_pruned(relpath, MANYLINUX_PRUNED)
+
+
+def _selector(selection: Optional[Selection]):
+    '''Get a members selector, given a selection of image entries.'''
+
+    if selection is None:
+        return None
+    else:
+        # Symbolic links are cheap, and required for resolving paths.
+        return lambda member: (member.kind == 'l') or selection(member.name)
+
+
+class _LayerPipe:
+    '''Pipe streaming a layer from a downloader to an extractor.'''
+
+    def __init__(self):
+        self._read, self._write = os.pipe()
+        self.aborted = False
+        self.committed = False
+
+    def fileno(self):
+        return self._read
+
+    def write(self, data):
+        if self._write is None:
+            return
+        view = memoryview(data)
+        try:
+            while view:
+                n = os.write(self._write, view)
+                view = view[n:]
+        except BrokenPipeError:
+            # The extraction failed. It will report on its own.
+            self._close_write()
+
+    def close(self):
+        '''Close the stream, after a successful (verified) download.'''
+        if self._write is not None:
+            self.committed = True
+            self._close_write()
+
+    def abort(self):
+        '''Close the stream, after a failed (or restarted) download.'''
+        if self._write is not None:
+            self.aborted = True
+            self._close_write()
+
+    def release(self):
+        '''Close the reading end of the pipe.'''
+        if self._read is not None:
+            os.close(self._read)
+            self._read = None
+
+    def _close_write(self):
+        if self._write is not None:
+            os.close(self._write)
+            self._write = None
+
+
+class LayerStream:
+    '''Extraction of image layers, overlapping with their download.
+
+    Layers are extracted in order, by a background thread, as soon as they are
+    available. The next layer to extract is read directly from the download
+    stream, if it is being downloaded.
+    '''
+
+    def __init__(self, extractor: ImageExtractor, destination: Path):
+        self.extractor = extractor
+        self.destination = destination
+        self._condition = threading.Condition()
+        self._pending = []
+        self._plans = {}
+        self._available = set()
+        self._pipes = {}
+        self._aborted = False
+        self._error = None
+        self._thread = None
+
+    def start(self, layers: List[str], missing: List[str]):
+        '''Start extracting, given the image layers and the missing ones.'''
+
+        pending = self.extractor._prepare(self.destination, layers)
+        with self._condition:
+            self._pending = list(pending)
+            self._plans = self.extractor._plan(pending)
+            self._available = set(layers) - set(missing)
+        if pending:
+            log('EXTRACT', f'{self.extractor.prefix.name}:'
+                           f'{self.extractor.tag} [streaming]')
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def feed(self, layer: str) -> Optional[_LayerPipe]:
+        '''Get a stream for a layer about to be downloaded, if expected.'''
+
+        with self._condition:
+            if self._aborted or (self._thread is None) or \
+               (not self._pending) or (self._pending[0] != layer):
+                return None
+            pipe = _LayerPipe()
+            self._pipes[layer] = pipe
+            self._condition.notify_all()
+            return pipe
+
+    def landed(self, layer: str):
+        '''Notify that a layer is available from the cache.'''
+
+        with self._condition:
+            self._available.add(layer)
+            self._condition.notify_all()
+
+    def finish(self):
+        '''Wait for the extraction to complete.'''
+
+        if self._thread is not None:
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        '''Stop extracting (e.g. after a download failure).'''
+
+        with self._condition:
+            self._aborted = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    if not self._pending:
+                        return
+                    layer = self._pending[0]
+                    while not (self._aborted or (layer in self._pipes) or
+                               (layer in self._available)):
+                        self._condition.wait()
+                    if self._aborted and (layer not in self._pipes):
+                        return
+                    self._pending.pop(0)
+                    pipe = self._pipes.pop(layer, None)
+
+                skip = self._plans.get(layer)
+                if pipe is None:
+                    self.extractor._extract_layer(self.destination, layer,
+                                                  skip=skip)
+                else:
+                    try:
+                        self.extractor._extract_layer(self.destination,
+                                                      layer, skip=skip,
+                                                      stream=pipe)
+                    except Exception:
+                        if not pipe.aborted:
+                            raise
+                    finally:
+                        pipe.release()
+
+                    if pipe.aborted:
+                        # The download was restarted (e.g. if the registry did
+                        # not honour a range request). The layer is extracted
+                        # from its blob instead, once landed.
+                        debug('RESTART', f'{layer}.tar.gz extraction')
+                        with self._condition:
+                            while not (self._aborted or
+                                       (layer in self._available)):
+                                self._condition.wait()
+                            if layer not in self._available:
+                                return
+                        self.extractor._extract_layer(self.destination,
+                                                      layer, skip=skip)
+        except BaseException as e:
+            self._error = e
+        finally:
+            with self._condition:
+                self._aborted = True
+                for pipe in self._pipes.values():
+                    pipe.release()
+                self._pipes.clear()
@@ -0,0 +1,212 @@
+import fnmatch
+import json
+import os
+from pathlib import Path, PurePosixPath
+import sqlite3
+from typing import List, Optional, Set
+
+from .unpack import Member
+from .view import glob_names, LayersView, resolve_name
+from ..utils.log import debug
+
+
+__all__ = ['ImageIndex']
+
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE entries (
+    name TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    mode INTEGER,
+    size INTEGER,
+    linkname TEXT
+);
+CREATE INDEX entries_parent ON entries (parent);
+CREATE TABLE libraries (name TEXT NOT NULL, dirname TEXT NOT NULL);
+CREATE INDEX libraries_name ON libraries (name);
+'''
+'''Schema of image index databases.'''
+
+CACHE_SIZE = 4096
+'''Maximum number of entries cached in memory, per index.'''
+
+
+class ImageIndex:
+    '''Content index of an image, stored as an SQLite database.
+
+    The index records the paths, types, sizes and symbolic links targets of
+    image entries, as well as the locations of shared libraries (by file
+    name). Paths are resolved as if the image root was the system one,
+    without accessing the image tree.
+    '''
+
+    def __init__(self, path: Path, root: Path):
+        self.path = path
+        self.root = root
+        self._db = sqlite3.connect(f'{Path(path).absolute().as_uri()}?mode=ro',
+                                   uri=True)
+        self._members = {}
+
+    @classmethod
+    def build(
+        cls,
+        path: Path,
+        root: Path,
+        view: LayersView,
+        sources: List[str],
+        ) -> 'ImageIndex':
+        '''Build the index of an image, given a view of its layers.
+
+        Sources identify the image content (e.g. layer digests and patches).
+        '''
+
+        debug('INDEX', path.name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}')
+        tmp.unlink(missing_ok=True)
+        try:
+            with sqlite3.connect(tmp) as db:
+                db.executescript(SCHEMA)
+                db.execute('INSERT INTO meta VALUES (?, ?)',
+                           ('sources', json.dumps(sources)))
+                entries, libraries = [], []
+                for member in view.members():
+                    parent, basename = member.name.rpartition('/')[::2]
+                    entries.append((member.name, parent, member.kind,
+                                    member.mode, member.size,
+                                    member.linkname))
+                    if (member.kind != 'd') and \
+                       fnmatch.fnmatchcase(basename, '*.so*'):
+                        libraries.append((basename, parent))
+                db.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                               entries)
+                db.executemany('INSERT INTO libraries VALUES (?, ?)',
+                               libraries)
+            db.close()
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return cls(path, root)
+
+    @classmethod
+    def load(
+        cls,
+        path: Path,
+        root: Path,
+        sources: List[str],
+        ) -> Optional['ImageIndex']:
+        '''Load the index of an image, if it exists and is up to date.'''
+
+        try:
+            index = cls(path, root)
+            indexed = index.sources()
+        except sqlite3.Error:
+            return None
+        if indexed != sources:
+            index.close()
+            return None
+        return index
+
+    def close(self):
+        self._db.close()
+
+    def exists(self, path: Path) -> bool:
+        try:
+            return self._lookup(self.resolve(path)) is not None
+        except OSError:
+            return False
+
+    def glob(self, pattern: Path) -> List[str]:
+        '''Get the paths matching a pattern, like glob.glob.'''
+
+        matches = glob_names(self._name(pattern), self._listdir,
+                             lambda name: self.exists(self.root / name))
+        return [str(self.root / match) for match in matches]
+
+    def is_dir(self, path: Path) -> bool:
+        try:
+            member = self._lookup(self.resolve(path))
+        except OSError:
+            return False
+        return (member is not None) and (member.kind == 'd')
+
+    def is_symlink(self, path: Path) -> bool:
+        member = self._lookup(self._locate(self._name(path)))
+        return (member is not None) and (member.kind == 'l')
+
+    def libraries(self, name: str) -> Set[str]:
+        '''Get the directories holding a shared library, given its name.'''
+
+        rows = self._db.execute(
+            'SELECT dirname FROM libraries WHERE name = ?', (name,))
+        return {dirname for (dirname,) in rows}
+
+    def readlink(self, path: Path) -> str:
+        member = self._lookup(self._locate(self._name(path)))
+        if member is None:
+            raise FileNotFoundError(path)
+        elif member.kind != 'l':
+            raise OSError(f'not a symbolic link ({path})')
+        return member.linkname
+
+    def resolve(self, path: Path) -> str:
+        '''Get the entry name of a path, following symbolic links.'''
+        return resolve_name(self._name(path), self._linkname)
+
+    def sources(self) -> Optional[List[str]]:
+        '''Get the sources of the indexed image content.'''
+
+        row = self._db.execute(
+            'SELECT value FROM meta WHERE key = ?', ('sources',)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _linkname(self, name: str) -> Optional[str]:
+        member = self._lookup(name)
+        if (member is not None) and (member.kind == 'l'):
+            return member.linkname
+
+    def _listdir(self, name: str) -> List[str]:
+        name = resolve_name(name, self._linkname)
+        member = self._lookup(name)
+        if (member is None) or (member.kind != 'd'):
+            raise NotADirectoryError(name)
+        rows = self._db.execute(
+            'SELECT name FROM entries WHERE parent = ?', (name,))
+        return [child.rpartition('/')[2] for (child,) in rows]
+
+    def _locate(self, name: str) -> str:
+        '''Resolve symbolic links of parent directories.'''
+        dirname, basename = name.rpartition('/')[::2]
+        dirname = resolve_name(dirname, self._linkname)
+        return f'{dirname}/{basename}' if dirname else basename
+
+    def _lookup(self, name: str) -> Optional[Member]:
+        try:
+            return self._members[name]
+        except KeyError:
+            pass
+        if not name:
+            member = Member('', 'd', mode=0o755)
+        else:
+            row = self._db.execute(
+                'SELECT kind, linkname, mode, size FROM entries '
+                'WHERE name = ?', (name,)
+            ).fetchone()
+            if row is None:
+                member = None
+            else:
+                kind, linkname, mode, size = row
+                member = Member(name, kind, linkname=linkname, mode=mode,
+                                size=size)
+        if len(self._members) >= CACHE_SIZE:
+            self._members.clear()
+        self._members[name] = member
+        return member
+
+    def _name(self, path: Path) -> str:
+        name = str(PurePosixPath(path).relative_to(self.root))
+        return '' if name == '.' else name
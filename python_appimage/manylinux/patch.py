@@ -2,10 +2,11 @@ from dataclasses import dataclass
 from pathlib import Path
 import os
 import stat
-import subprocess
-from typing import Optional
+import tarfile
+from typing import List, Optional
 
 from .config import Arch, LinuxTag
+from .unpack import unpack_layer
 from ..utils.deps import CACHE_DIR
 from ..utils.log import debug, log
 from ..utils.url import urlretrieve
@@ -21,13 +22,31 @@ class Patcher:
 
 
     def patch(self, destination: Path):
-        '''Apply any patch'''
+        '''Apply any patch
+
+        Patches are written over the image tree like layers, i.e. existing
+        entries are replaced rather than modified. Thus, files shared with the
+        layers store (as hardlinks) are left untouched.
+        '''
+
+        for path in self.patches():
+            log('PATCH', path.name[:-7])
+            debug('EXTRACT', path.name)
+            try:
+                with path.open('rb') as f:
+                    unpack_layer(f, destination)
+            except (OSError, tarfile.TarError) as e:
+                raise ValueError(f'could not apply {path.name} ({e})')
+
+
+    def patches(self) -> List[Path]:
+        '''Get patches (as tarballs), downloading them if needed'''
 
         cache = Path(CACHE_DIR) / f'share/patches/'
 
+        patches = []
         if self.tag == LinuxTag.MANYLINUX_1:
             patch = f'tk-manylinux1_{self.arch}'
-            log('PATCH', patch)
             tarfile = f'{patch}.tar.gz'
             path = cache / tarfile
             if not path.exists():
@@ -35,14 +54,6 @@ class Patcher:
                 urlretrieve(url, path)
                 mode = os.stat(path)[stat.ST_MODE]
                 os.chmod(path, mode | stat.S_IWGRP | stat.S_IWOTH)
+            patches.append(path)
 
-            debug('EXTRACT', tarfile)
-            cmd = ''.join((
-                 f'trap \'chmod u+rw -R {destination}\' EXIT ; ',
-                 f'mkdir -p {destination} && ',
-                 f'tar -xzf {path} -C {destination}',
-            ))
-            r = subprocess.run(f'/bin/bash -c "{cmd}"', shell=True,
-                               capture_output=True)
-            if r.returncode != 0:
-                raise ValueError(r.stderr.decode())
+        return patches
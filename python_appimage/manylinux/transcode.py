@@ -0,0 +1,273 @@
+import bisect
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+from pathlib import Path
+import struct
+import zlib
+
+from .download import BLOBS_DIR, BUFFER_SIZE, record_verification, \
+                      verify_layer
+from ..utils.log import debug
+
+try:
+    from compression import zstd as _zstd # Python >= 3.14.
+except ImportError:
+    _zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+__all__ = ['FORMATS', 'has_zstd', 'layer_path', 'members_path', 'open_layer',
+           'transcode_layer', 'verify_transcoded', 'ZstdReader']
+
+
+FORMATS = ('tar', 'zstd')
+'''Formats to which cached layers can be transcoded.'''
+
+SUFFIXES = {'gzip': '.tar.gz', 'tar': '.tar', 'zstd': '.tar.zst'}
+'''File suffixes of layer formats.'''
+
+FRAME_SIZE = 4 * 1024 * 1024
+'''Uncompressed size of zstd frames, when transcoding layers.'''
+
+ZSTD_LEVEL = 3
+'''Compression level, when transcoding layers to zstd.'''
+
+SKIPPABLE_MAGIC = 0x184D2A5E
+'''Magic number of zstd skippable frames (holding the seek table).'''
+
+SEEKABLE_MAGIC = 0x8F92EAB1
+'''Magic number of the zstd seekable format footer.'''
+
+
+def has_zstd() -> bool:
+    '''Check if a zstd implementation is available.'''
+    return (_zstd is not None) or (zstandard is not None)
+
+
+def _compress(data: bytes) -> bytes:
+    if _zstd is not None:
+        return _zstd.compress(data, level=ZSTD_LEVEL)
+    else:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _decompress(data: bytes) -> bytes:
+    if _zstd is not None:
+        return _zstd.decompress(data)
+    else:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+def members_path(path: Path) -> Path:
+    '''Get the members table of a layer, whatever its format.'''
+
+    for suffix in SUFFIXES.values():
+        if path.name.endswith(suffix):
+            name = path.name[:-len(suffix)]
+            break
+    else:
+        name = path.name
+    return path.with_name(f'{name}.tar.gz.members')
+
+
+def layer_path(hash_: str) -> Path:
+    '''Get the fastest available format of a cached layer.'''
+
+    for format_ in ('tar', 'zstd'):
+        if (format_ == 'zstd') and not has_zstd():
+            continue
+        path = BLOBS_DIR / f'{hash_}{SUFFIXES[format_]}'
+        if verify_transcoded(path, hash_):
+            return path
+    return BLOBS_DIR / f'{hash_}.tar.gz'
+
+
+@contextmanager
+def open_layer(path: Path):
+    '''Open a layer for sequential reading.
+
+    Yield a file object and its compression, as a tarfile stream mode suffix.
+    '''
+
+    if path.name.endswith('.tar.zst'):
+        reader = ZstdReader(path)
+        try:
+            yield _SequentialReader(reader), ''
+        finally:
+            reader.close()
+    else:
+        with path.open('rb') as f:
+            yield f, ('' if path.name.endswith('.tar') else 'gz')
+
+
+def transcode_layer(hash_: str, format_: str) -> Path:
+    '''Transcode a cached (gzipped) layer to a faster format.
+
+    The source layer is verified first. The transcoded file is recorded with
+    its own digest and with the source one (for provenance). Other transcoded
+    formats of the layer are removed.
+    '''
+
+    source = BLOBS_DIR / f'{hash_}.tar.gz'
+    destination = BLOBS_DIR / f'{hash_}{SUFFIXES[format_]}'
+    if verify_transcoded(destination, hash_):
+        return destination
+
+    if not verify_layer(source, hash_):
+        raise ValueError(f'could not verify {source.name}')
+    if (format_ == 'zstd') and not has_zstd():
+        raise ValueError('zstd requires Python 3.14, or the zstandard package')
+
+    debug('TRANSCODE', f'{source.name} -> {destination.name}')
+    tmp = destination.with_name(f'{destination.name}.{os.getpid()}')
+    hasher = hashlib.sha256()
+    try:
+        with source.open('rb') as src, tmp.open('wb') as dst:
+            def write(data):
+                hasher.update(data)
+                dst.write(data)
+
+            decompressor = zlib.decompressobj(wbits=31)
+            frames = []
+            pending = b''
+            while True:
+                chunk = src.read(BUFFER_SIZE)
+                if not chunk:
+                    break
+                data = decompressor.decompress(chunk)
+                while decompressor.eof and decompressor.unused_data:
+                    unused = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=31)
+                    data += decompressor.decompress(unused)
+
+                if format_ == 'tar':
+                    write(data)
+                    continue
+
+                pending += data
+                while len(pending) >= FRAME_SIZE:
+                    frame = _compress(pending[:FRAME_SIZE])
+                    frames.append((len(frame), FRAME_SIZE))
+                    write(frame)
+                    pending = pending[FRAME_SIZE:]
+
+            if not decompressor.eof:
+                raise ValueError(f'truncated layer ({source.name})')
+
+            if format_ == 'zstd':
+                if pending:
+                    frame = _compress(pending)
+                    frames.append((len(frame), len(pending)))
+                    write(frame)
+                write(_seek_table(frames))
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp, destination)
+    record_verification(destination, hasher.hexdigest(), source=hash_)
+
+    for other in SUFFIXES.values():
+        if other not in ('.tar.gz', SUFFIXES[format_]):
+            path = BLOBS_DIR / f'{hash_}{other}'
+            path.unlink(missing_ok=True)
+            path.with_name(f'{path.name}.verified').unlink(missing_ok=True)
+
+    return destination
+
+
+def verify_transcoded(path: Path, hash_: str, *, force=False) -> bool:
+    '''Check that a transcoded layer matches its recorded digest.'''
+
+    sidecar = path.with_name(f'{path.name}.verified')
+    try:
+        with sidecar.open() as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if record.get('source') != f'sha256:{hash_}':
+        return False
+    digest = record.get('digest', '')
+    if not digest.startswith('sha256:'):
+        return False
+    return verify_layer(path, digest[7:], force=force, source=hash_)
+
+
+class ZstdReader:
+    '''Random access reader of a seekable zstd file.'''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = path.open('rb')
+
+        # Read the seek table.
+        self._file.seek(-9, os.SEEK_END)
+        n, descriptor, magic = struct.unpack('<IBI', self._file.read(9))
+        if magic != SEEKABLE_MAGIC:
+            raise ValueError(f'missing seek table ({path.name})')
+        entry_size = 12 if descriptor & 0x80 else 8
+        self._file.seek(-9 - n * entry_size, os.SEEK_END)
+        table = self._file.read(n * entry_size)
+
+        self._offsets = [0]     # Uncompressed offsets of frames.
+        self._positions = [0]   # Compressed offsets of frames.
+        for i in range(n):
+            compressed, decompressed = struct.unpack_from(
+                '<II', table, i * entry_size)
+            self._positions.append(self._positions[-1] + compressed)
+            self._offsets.append(self._offsets[-1] + decompressed)
+        self.size = self._offsets[-1]
+        self._frame = (None, b'')
+
+    def close(self):
+        self._file.close()
+
+    def read(self, offset: int, size: int) -> bytes:
+        '''Read uncompressed data.'''
+
+        chunks = []
+        end = min(offset + size, self.size)
+        while offset < end:
+            i = bisect.bisect_right(self._offsets, offset) - 1
+            if self._frame[0] != i:
+                self._file.seek(self._positions[i])
+                frame = self._file.read(self._positions[i + 1] -
+                                        self._positions[i])
+                self._frame = (i, _decompress(frame))
+            data = self._frame[1]
+            start = offset - self._offsets[i]
+            chunk = data[start:start + end - offset]
+            chunks.append(chunk)
+            offset += len(chunk)
+        return b''.join(chunks)
+
+
+class _SequentialReader:
+    '''Sequential (file-like) reader over a random access one.'''
+
+    def __init__(self, reader: ZstdReader):
+        self._reader = reader
+        self._offset = 0
+
+    def read(self, size: int=-1) -> bytes:
+        if (size is None) or (size < 0):
+            size = self._reader.size - self._offset
+        data = self._reader.read(self._offset, size)
+        self._offset += len(data)
+        return data
+
+
+def _seek_table(frames) -> bytes:
+    '''Encode a zstd seek table, as a skippable frame.'''
+
+    entries = b''.join(struct.pack('<II', compressed, decompressed)
+                       for compressed, decompressed in frames)
+    footer = struct.pack('<IBI', len(frames), 0, SEEKABLE_MAGIC)
+    content = entries + footer
+    return struct.pack('<II', SKIPPABLE_MAGIC, len(content)) + content
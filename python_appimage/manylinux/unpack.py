@@ -0,0 +1,567 @@
+import fcntl
+import json
+import os
+from pathlib import Path, PurePosixPath
+import re
+import shutil
+import stat
+import tarfile
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+
+from ..utils.log import log
+
+
+__all__ = ['check_layer', 'clone_file', 'compose_layer', 'index_layer',
+           'load_members', 'Member', 'plan_layers', 'resolve_member',
+           'save_members', 'Selection', 'unpack_layer']
+
+
+BUFFER_SIZE = 1024 * 1024
+'''Copy buffer size, when writing files.'''
+
+EXCLUDED = ('dev',)
+'''Top level directories that are not extracted.'''
+
+WHITEOUT = '.wh.'
+'''Prefix of OCI whiteout files.'''
+
+OPAQUE = '.wh..wh..opq'
+'''Name of OCI opaque directory markers.'''
+
+FICLONE = 0x40049409
+'''Linux ioctl request for cloning (reflinking) a file.'''
+
+
+class Member(NamedTuple):
+    '''Entry of a layer members table.'''
+
+    name: str
+    '''Normalised path of the entry, relative to the image root.'''
+
+    kind: str
+    '''Entry kind, one of (d)irectory, (f)ile, (l)ink, (h)ardlink,
+       (w)hiteout or (o)paque marker.'''
+
+    linkname: Optional[str] = None
+    '''Target of (hard) links.'''
+
+    mode: Optional[int] = None
+    '''Permission bits.'''
+
+    size: Optional[int] = None
+    '''Size of file data.'''
+
+    offset: Optional[int] = None
+    '''Offset of file data, in the uncompressed layer.'''
+
+
+def _normalise(name: str) -> Optional[str]:
+    '''Normalise a member name, or return None if it is unsafe.'''
+
+    parts = []
+    for part in PurePosixPath(name).parts:
+        if part in ('/', '.', ''):
+            continue
+        elif part == '..':
+            return None
+        else:
+            parts.append(part)
+    return '/'.join(parts) if parts else None
+
+
+def _classify(info: tarfile.TarInfo, name: str) -> Optional[Member]:
+    '''Classify a tar entry (None for entries that are not extracted).'''
+
+    dirname, basename = name.rpartition('/')[::2]
+    if basename == OPAQUE:
+        return Member(dirname, 'o')
+    elif basename.startswith(WHITEOUT):
+        target = basename[len(WHITEOUT):]
+        target = f'{dirname}/{target}' if dirname else target
+        return Member(target, 'w')
+    mode = stat.S_IMODE(info.mode)
+    if info.isdir():
+        return Member(name, 'd', mode=mode)
+    elif info.isreg():
+        return Member(name, 'f', mode=mode, size=info.size,
+                      offset=info.offset_data)
+    elif info.issym():
+        return Member(name, 'l', info.linkname, mode=mode)
+    elif info.islnk():
+        linkname = _normalise(info.linkname)
+        if linkname is None:
+            return None
+        return Member(name, 'h', linkname, mode=mode)
+    else:
+        # Devices and fifos cannot be created without privileges.
+        return None
+
+
+def _members(tar: tarfile.TarFile):
+    '''Iterate over the extracted entries of a tar archive.'''
+
+    for info in tar:
+        name = _normalise(info.name)
+        if name is None:
+            if info.name.strip('./'):
+                log('WARNING', f'skipping unsafe entry {info.name}')
+            continue
+        if name.split('/', 1)[0] in EXCLUDED:
+            continue
+
+        member = _classify(info, name)
+        if member is not None:
+            yield info, member
+
+
+def index_layer(fileobj, *, compression: str='gz') -> List[Member]:
+    '''Get the members table of a layer, without unpacking it.'''
+
+    with tarfile.open(fileobj=fileobj, mode=f'r|{compression}') as tar:
+        return [member for _, member in _members(tar)]
+
+
+def load_members(path: Path) -> Optional[List[Member]]:
+    '''Load a members table (None if it is missing or invalid).'''
+
+    try:
+        with path.open() as f:
+            return [Member(*entry) for entry in json.load(f)]
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def save_members(path: Path, table: List[Member]):
+    '''Save a members table, atomically.'''
+
+    tmp = path.with_name(f'{path.name}.{os.getpid()}')
+    with tmp.open('w') as f:
+        json.dump(table, f)
+    os.replace(tmp, path)
+
+
+def _ancestors(name: str) -> Iterable[str]:
+    '''Proper ancestors of a path, from the root.'''
+    parts = name.split('/')
+    for i in range(1, len(parts)):
+        yield '/'.join(parts[:i])
+
+
+class Selection:
+    '''Selection of image entries, given path patterns.
+
+    Patterns are matched against entries and their ancestors, such that
+    selecting a directory selects its content. Wildcards (* and ?) do not
+    match path separators.
+    '''
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = tuple(patterns)
+        regex = '|'.join(self._translate(p) for p in self.patterns)
+        self._regex = re.compile(f'(?:{regex})(?:/.*)?\\Z', re.DOTALL)
+
+    def __call__(self, name: str) -> bool:
+        return bool(self.patterns) and (self._regex.match(name) is not None)
+
+    @staticmethod
+    def _translate(pattern: str) -> str:
+        return ''.join('[^/]*' if c == '*' else '[^/]' if c == '?' else
+                       re.escape(c) for c in pattern)
+
+
+def resolve_member(index: Dict[str, Member], name: str) -> str:
+    '''Resolve symbolic links of an entry name, given the image members.
+
+    Path components containing wildcards are not resolved, nor any following
+    component.
+    '''
+
+    parts = name.split('/')
+    for depth in range(40):
+        for i, part in enumerate(parts):
+            if ('*' in part) or ('?' in part):
+                return '/'.join(parts)
+            member = index.get('/'.join(parts[:i + 1]))
+            if (member is not None) and (member.kind == 'l'):
+                base = '' if member.linkname.startswith('/') else \
+                       '/'.join(parts[:i])
+                target = _Tree._join(base, member.linkname)
+                parts = target.split('/') + parts[i + 1:]
+                break
+        else:
+            return '/'.join(parts)
+    raise OSError(f'too many levels of symbolic links ({name})')
+
+
+def plan_layers(tables: List[Optional[List[Member]]]) -> List[Set[str]]:
+    '''Plan the extraction of a stack of layers.
+
+    Given the members tables of layers (ordered from bottom to top), return
+    for each layer the set of entries that need not be written, since a later
+    layer deletes or replaces them. Unknown tables (None) are not planned.
+    '''
+
+    written: Dict[str, bool] = {}   # path -> is a directory
+    removed: Set[str] = set()       # whiteout targets
+    opaque: Set[str] = set()        # opaque directories
+
+    plans = [set() for _ in tables]
+    for i in reversed(range(len(tables))):
+        table = tables[i]
+        if table is None:
+            continue
+
+        # Hardlink targets are always written.
+        targets = {m.linkname for m in table if m.kind == 'h'}
+
+        skip = plans[i]
+        for member in table:
+            if member.kind in ('w', 'o') or member.name in targets:
+                continue
+            name = member.name
+            if name in removed:
+                skip.add(name)
+                continue
+            later = written.get(name)
+            if (later is not None) and not (later and member.kind == 'd'):
+                skip.add(name)
+                continue
+            for ancestor in _ancestors(name):
+                if (ancestor in removed) or (ancestor in opaque) or \
+                   (written.get(ancestor) is False):
+                    skip.add(name)
+                    break
+
+        for member in table:
+            if member.kind == 'w':
+                removed.add(member.name)
+            elif member.kind == 'o':
+                opaque.add(member.name)
+            else:
+                isdir = member.kind == 'd'
+                written[member.name] = written.get(member.name, True) and \
+                                       isdir
+
+    return plans
+
+
+class _Tree:
+    '''Image tree being written, resolving symlinks within its root.'''
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._dirs: Dict[str, Path] = {'': root}
+
+    def resolve(self, name: str) -> Path:
+        '''Get the actual location of an entry.
+
+        Symbolic links of parent directories are followed as if the tree root
+        were the file system root.
+        '''
+        dirname, basename = name.rpartition('/')[::2]
+        return self.resolve_dir(dirname) / basename
+
+    def resolve_dir(self, name: str, depth: int=0) -> Path:
+        try:
+            return self._dirs[name]
+        except KeyError:
+            pass
+
+        if depth > 40:
+            raise OSError(f'too many levels of symbolic links ({name})')
+
+        path = self.resolve(name)
+        if path.is_symlink():
+            target = os.readlink(path)
+            if target.startswith('/'):
+                base = ''
+            else:
+                base = str(path.parent.relative_to(self.root))
+                base = '' if base == '.' else base
+            path = self.resolve_dir(self._join(base, target), depth + 1)
+        self._dirs[name] = path
+        return path
+
+    @staticmethod
+    def _join(base: str, target: str) -> str:
+        '''Join paths, without escaping the tree root.'''
+        parts = base.split('/') if base else []
+        for part in target.split('/'):
+            if part in ('', '.'):
+                continue
+            elif part == '..':
+                if parts:
+                    parts.pop()
+            else:
+                parts.append(part)
+        return '/'.join(parts)
+
+    def forget(self, name: str):
+        '''Invalidate resolved directories, after removing an entry.'''
+        if name in self._dirs:
+            prefix = f'{name}/'
+            for key in [key for key in self._dirs if key == name or
+                        key.startswith(prefix)]:
+                del self._dirs[key]
+
+    def remove(self, path: Path, name: str):
+        '''Remove an entry from the tree, if it exists.'''
+        try:
+            st = path.lstat()
+        except FileNotFoundError:
+            return
+        if stat.S_ISDIR(st.st_mode):
+            shutil.rmtree(path, onerror=_force_remove)
+        else:
+            path.unlink()
+        self.forget(name)
+
+
+def _force_remove(function, path, excinfo):
+    '''Grant write permission on parent directories, for rmtree.'''
+    parent = os.path.dirname(path)
+    os.chmod(parent, os.stat(parent).st_mode | stat.S_IRWXU)
+    function(path)
+
+
+class _Writer:
+    '''Writer of layer entries over an image tree.'''
+
+    def __init__(
+        self,
+        destination: Path,
+        *,
+        skip: Optional[Set[str]]=None,
+        select: Optional[Callable[[Member], bool]]=None,
+        whiteouts: bool=True,
+        ):
+        destination.mkdir(parents=True, exist_ok=True)
+        self.tree = _Tree(destination)
+        self.skip = skip or set()
+        self.select = select
+        self.whiteouts = whiteouts
+        self.written = set() # Entries of this layer, and their ancestors.
+        self.parents = set() # Directories known to exist.
+
+    def accept(self, member: Member) -> Optional[Path]:
+        '''Process a member, and return its location if it must be written.
+
+        Whiteouts are applied directly. Any existing entry is removed from the
+        returned location, unless both are directories.
+        '''
+
+        if member.kind in ('w', 'o'):
+            if not self.whiteouts:
+                pass
+            elif member.kind == 'w':
+                self.tree.remove(self.tree.resolve(member.name), member.name)
+            else:
+                _apply_opaque(self.tree, member.name, self.written)
+            self.parents.clear()
+            return None
+
+        name = member.name
+        self.written.add(name)
+        self.written.update(_ancestors(name))
+        if (name in self.skip) or \
+           ((self.select is not None) and not self.select(member)):
+            return None
+
+        path = self.tree.resolve(name)
+        if path.parent not in self.parents:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.parents.add(path.parent)
+
+        try:
+            st = path.lstat()
+        except FileNotFoundError:
+            pass
+        else:
+            if (member.kind != 'd') or not stat.S_ISDIR(st.st_mode):
+                self.tree.remove(path, name)
+        return path
+
+    def directory(self, path: Path, mode: int):
+        '''Write a directory entry, keeping it accessible to its owner.'''
+
+        if not path.is_dir():
+            path.mkdir()
+        path.chmod(stat.S_IMODE(mode) | stat.S_IRWXU)
+
+    def hardlink(self, member: Member, path: Path):
+        '''Write a hardlink entry, given its target in this tree.'''
+
+        target = self.tree.resolve(member.linkname)
+        try:
+            clone_file(target, path)
+        except FileNotFoundError:
+            if self.select is None:
+                log('WARNING', f'missing hardlink target for {member.name}')
+
+
+def clone_file(source: Path, destination: Path):
+    '''Clone a file, sharing its data if possible.
+
+    The file is hardlinked, or reflinked (on file systems that support it),
+    or copied otherwise.
+    '''
+
+    try:
+        os.link(source, destination)
+        return
+    except FileNotFoundError:
+        raise
+    except OSError:
+        pass
+
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            shutil.copyfileobj(src, dst, BUFFER_SIZE)
+    shutil.copystat(source, destination)
+
+
+def unpack_layer(
+    fileobj,
+    destination: Path,
+    *,
+    skip: Optional[Set[str]]=None,
+    select: Optional[Callable[[Member], bool]]=None,
+    whiteouts: bool=True,
+    compression: str='gz',
+    ) -> List[Member]:
+    '''Unpack a (compressed) layer over an image tree.
+
+    OCI whiteouts are applied to the existing tree (unless *whiteouts* is
+    false, e.g. when unpacking a layer on its own), and entries listed in
+    *skip* or rejected by *select* are not written. Permissions are normalised
+    as entries are written, such that the tree remains readable and writable
+    by its owner. The full layer members table is returned.
+    '''
+
+    writer = _Writer(destination, skip=skip, select=select,
+                     whiteouts=whiteouts)
+    table = []
+
+    with tarfile.open(fileobj=fileobj, mode=f'r|{compression}') as tar:
+        for info, member in _members(tar):
+            table.append(member)
+
+            path = writer.accept(member)
+            if path is None:
+                continue
+            elif member.kind == 'd':
+                writer.directory(path, info.mode)
+            elif member.kind == 'f':
+                mode = stat.S_IMODE(info.mode) | stat.S_IRUSR | stat.S_IWUSR
+                source = tar.extractfile(info)
+                with open(path, 'wb') as f:
+                    shutil.copyfileobj(source, f, BUFFER_SIZE)
+                    os.fchmod(f.fileno(), mode)
+                os.utime(path, (info.mtime, info.mtime))
+            elif member.kind == 'l':
+                os.symlink(member.linkname, path)
+            else:
+                writer.hardlink(member, path)
+
+    return table
+
+
+def compose_layer(
+    source: Path,
+    table: List[Member],
+    destination: Path,
+    *,
+    skip: Optional[Set[str]]=None,
+    select: Optional[Callable[[Member], bool]]=None,
+    whiteouts: bool=True,
+    ) -> None:
+    '''Compose an unpacked layer over an image tree.
+
+    This is equivalent to unpack_layer, but for a layer previously unpacked on
+    its own, given its members table. Files are cloned from the source tree
+    (see clone_file), which must thus not be modified afterwards.
+    '''
+
+    writer = _Writer(destination, skip=skip, select=select,
+                     whiteouts=whiteouts)
+    tree = _Tree(source)
+
+    for member in table:
+        path = writer.accept(member)
+        if path is None:
+            continue
+        elif member.kind == 'd':
+            try:
+                mode = tree.resolve(member.name).stat().st_mode
+            except FileNotFoundError:
+                mode = stat.S_IRWXU
+            writer.directory(path, mode)
+        elif member.kind == 'f':
+            clone_file(tree.resolve(member.name), path)
+        elif member.kind == 'l':
+            os.symlink(member.linkname, path)
+        else:
+            try:
+                clone_file(tree.resolve(member.name), path)
+            except FileNotFoundError:
+                writer.hardlink(member, path)
+
+
+def check_layer(
+    table: List[Member],
+    destination: Path,
+    *,
+    skip: Optional[Set[str]]=None,
+    select: Optional[Callable[[Member], bool]]=None,
+    ) -> List[str]:
+    '''Check that a layer was written over an image tree.
+
+    Written entries must exist with the expected type, and files with the
+    expected size. The names of mismatching entries are returned.
+    '''
+
+    skip = skip or set()
+    tree = _Tree(destination)
+    members = {}
+    for member in table:
+        if member.kind in ('w', 'o'):
+            continue
+        elif (member.name in skip) or \
+             ((select is not None) and not select(member)):
+            members.pop(member.name, None)
+        else:
+            members[member.name] = member
+
+    mismatches = []
+    for name, member in members.items():
+        if member.kind == 'h':
+            continue # Hardlinks might lack their target, when selecting.
+        try:
+            st = tree.resolve(name).lstat()
+        except OSError:
+            mismatches.append(name)
+            continue
+        if member.kind == 'd':
+            valid = stat.S_ISDIR(st.st_mode)
+        elif member.kind == 'l':
+            valid = stat.S_ISLNK(st.st_mode)
+        else:
+            valid = stat.S_ISREG(st.st_mode) and (st.st_size == member.size)
+        if not valid:
+            mismatches.append(name)
+    return mismatches
+
+
+def _apply_opaque(tree: _Tree, name: str, written: Set[str]):
+    '''Remove the content of a directory, inherited from lower layers.'''
+
+    path = tree.resolve(name) if name else tree.root
+    if not path.is_dir():
+        return
+    prefix = f'{name}/' if name else ''
+    for entry in os.listdir(path):
+        child = f'{prefix}{entry}'
+        if child not in written:
+            tree.remove(path / entry, child)
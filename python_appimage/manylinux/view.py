@@ -0,0 +1,452 @@
+import bisect
+from contextlib import contextmanager, nullcontext
+import fnmatch
+import glob
+import os
+from pathlib import Path, PurePosixPath
+import stat
+import tempfile
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+import zlib
+
+from .transcode import members_path, open_layer, ZstdReader
+from .unpack import index_layer, load_members, Member, save_members
+from ..utils.fs import copy_tree, fast_copy
+from ..utils.log import debug
+
+
+__all__ = ['DirectoryView', 'GzipReader', 'LayersView', 'TarReader']
+
+
+CHECKPOINT_SPACING = 4 * 1024 * 1024
+'''Spacing (in uncompressed bytes) of decompression checkpoints.'''
+
+CHUNK_SIZE = 256 * 1024
+'''Size of compressed chunks fed to the decompressor.'''
+
+
+class GzipReader:
+    '''Random access reader of a gzip file.
+
+    Decompression checkpoints are recorded while reading, such that any data
+    preceding the furthest read position can be accessed again without
+    decompressing the file from its start. Python's zlib cannot restore a
+    decompressor at an arbitrary bit position. Thus, checkpoints are copies of
+    the decompressor state, which are only kept in memory.
+    '''
+
+    def __init__(self, path: Path, spacing: int=CHECKPOINT_SPACING):
+        self.path = path
+        self.spacing = spacing
+        self._file = open(path, 'rb')
+        # Checkpoints, as uncompressed offset, compressed offset and state.
+        self._offsets = [0]
+        self._checkpoints = [(0, zlib.decompressobj(wbits=31))]
+        self._cursor = None
+
+    def close(self):
+        self._file.close()
+
+    def read(self, offset: int, size: int) -> bytes:
+        '''Read uncompressed data.'''
+
+        if (self._cursor is None) or (offset < self._cursor[2]):
+            i = bisect.bisect_right(self._offsets, offset) - 1
+            position, state = self._checkpoints[i]
+            self._cursor = (state.copy(), position, self._offsets[i], b'')
+        decompressor, position, start, pending = self._cursor
+
+        end = offset + size
+        while start + len(pending) < end:
+            self._file.seek(position)
+            chunk = self._file.read(CHUNK_SIZE)
+            if not chunk:
+                raise EOFError(f'unexpected end of {self.path.name}')
+            position += len(chunk)
+            data = decompressor.decompress(chunk)
+            while decompressor.eof and decompressor.unused_data:
+                # Concatenated gzip members.
+                unused = decompressor.unused_data
+                decompressor = zlib.decompressobj(wbits=31)
+                data += decompressor.decompress(unused)
+
+            if start + len(pending) + len(data) <= offset:
+                start += len(pending) + len(data)
+                pending = b''
+            else:
+                pending += data
+                if start < offset:
+                    pending = pending[offset - start:]
+                    start = offset
+
+            reached = start + len(pending)
+            if reached >= self._offsets[-1] + self.spacing:
+                self._offsets.append(reached)
+                self._checkpoints.append((position, decompressor.copy()))
+
+        data = pending[offset - start:end - start]
+        self._cursor = (decompressor, position, end, pending[end - start:])
+        return data
+
+
+class TarReader:
+    '''Random access reader of an uncompressed file.'''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, 'rb')
+
+    def close(self):
+        self._file.close()
+
+    def read(self, offset: int, size: int) -> bytes:
+        '''Read data.'''
+        self._file.seek(offset)
+        return self._file.read(size)
+
+
+class DirectoryView:
+    '''Read-only view of an extracted image.'''
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def copy(self, src: Path, dst: Path):
+        fast_copy(src, dst)
+
+    def copytree(self, src: Path, dst: Path, *, dirs_exist_ok=False,
+                 ignore: Optional[Callable[[str], bool]]=None):
+        if dst.exists() and not dirs_exist_ok:
+            raise FileExistsError(dst)
+        copy_tree(src, dst, update=False, ignore=ignore)
+
+    def exists(self, path: Path) -> bool:
+        return path.exists()
+
+    def glob(self, pattern: Path) -> List[str]:
+        return glob.glob(str(pattern))
+
+    def is_dir(self, path: Path) -> bool:
+        return path.is_dir()
+
+    def is_symlink(self, path: Path) -> bool:
+        return path.is_symlink()
+
+    def local(self, path: Path):
+        '''Get a local file path, for external tools.'''
+        return nullcontext(path)
+
+    def mode(self, path: Path) -> int:
+        return path.stat().st_mode
+
+    def read_bytes(self, path: Path) -> bytes:
+        return path.read_bytes()
+
+    def readlink(self, path: Path) -> str:
+        return os.readlink(path)
+
+
+class LayersView:
+    '''Read-only view of an image, merged from its compressed layers.
+
+    Paths are given as if the image was extracted at *root*. Layers are
+    indexed once (see index_layer). Then, file data are read directly from
+    the compressed layers (see GzipReader).
+    '''
+
+    def __init__(self, root: Path, layers: List[Path]):
+        self.root = root
+        self._layers = layers
+        self._readers = {}
+        self._entries: Dict[str, Tuple[int, Member]] = {
+            '': (-1, Member('', 'd', mode=0o755))
+        }
+        self._children: Dict[str, Set[str]] = {'': set()}
+
+        for i, layer in enumerate(layers):
+            path = members_path(layer)
+            table = load_members(path)
+            if (table is None) or any((member.kind == 'f') and
+                                      (member.offset is None)
+                                      for member in table):
+                debug('INDEX', layer.name)
+                with open_layer(layer) as (f, compression):
+                    table = index_layer(f, compression=compression)
+                save_members(path, table)
+            self._merge(i, table)
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers.clear()
+
+    def copy(self, src: Path, dst: Path):
+        '''Copy a file (following symbolic links), like shutil.copy.'''
+
+        if dst.is_dir():
+            dst = dst / src.name
+        layer, member = self._entry(src)
+        self._write(layer, member, dst)
+
+    def copytree(self, src: Path, dst: Path, *, dirs_exist_ok=False,
+                 ignore: Optional[Callable[[str], bool]]=None):
+        '''Copy a directory (preserving symbolic links), like shutil.copytree.
+
+        Paths (relative to src) for which ignore returns true are not copied.
+        '''
+
+        root = self._resolve(self._name(src))
+        entry = self._entries.get(root)
+        if (entry is None) or (entry[1].kind != 'd'):
+            raise NotADirectoryError(src)
+
+        files, dirs = [], []
+        def recurse(name, path):
+            path.mkdir(parents=True, exist_ok=dirs_exist_ok)
+            dirs.append((name, path))
+            for child in sorted(self._children.get(name, ())):
+                if (ignore is not None) and \
+                   ignore(child[len(root) + 1:] if root else child):
+                    continue
+                layer, member = self._entries[child]
+                target = path / child.rpartition('/')[2]
+                if member.kind == 'l':
+                    os.symlink(member.linkname, target)
+                elif member.kind == 'd':
+                    recurse(child, target)
+                else:
+                    files.append((layer, member, target))
+        recurse(root, dst)
+
+        # Files are read in storage order, for sequential decompression.
+        files.sort(key=lambda item: (item[0], item[1].offset or 0))
+        for layer, member, target in files:
+            self._write(layer, member, target)
+        for name, path in reversed(dirs):
+            mode = self._entries[name][1].mode
+            if mode is not None:
+                path.chmod(mode | stat.S_IRWXU)
+
+    def exists(self, path: Path) -> bool:
+        try:
+            return self._resolve(self._name(path)) in self._entries
+        except OSError:
+            return False
+
+    def glob(self, pattern: Path) -> List[str]:
+        '''Get the paths matching a pattern, like glob.glob.'''
+
+        matches = glob_names(self._name(pattern), self._listdir,
+                             lambda name: self.exists(self.root / name))
+        return [str(self.root / match) for match in matches]
+
+    def is_dir(self, path: Path) -> bool:
+        try:
+            entry = self._entries.get(self._resolve(self._name(path)))
+        except OSError:
+            return False
+        return (entry is not None) and (entry[1].kind == 'd')
+
+    def is_symlink(self, path: Path) -> bool:
+        entry = self._entries.get(self._locate(self._name(path)))
+        return (entry is not None) and (entry[1].kind == 'l')
+
+    def members(self) -> Iterator[Member]:
+        '''Iterate over the image entries, named by their location.'''
+
+        for name, (_, member) in self._entries.items():
+            if name:
+                yield member._replace(name=name)
+
+    @contextmanager
+    def local(self, path: Path):
+        '''Get a local file path, for external tools.'''
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir) / path.name
+            self.copy(path, tmp)
+            yield tmp
+
+    def mode(self, path: Path) -> int:
+        layer, member = self._entry(path)
+        return member.mode
+
+    def read_bytes(self, path: Path) -> bytes:
+        layer, member = self._entry(path)
+        if member.kind != 'f':
+            raise IsADirectoryError(path)
+        return self._reader(layer).read(member.offset, member.size)
+
+    def readlink(self, path: Path) -> str:
+        entry = self._entries.get(self._locate(self._name(path)))
+        if entry is None:
+            raise FileNotFoundError(path)
+        elif entry[1].kind != 'l':
+            raise OSError(f'not a symbolic link ({path})')
+        return entry[1].linkname
+
+    def _add(self, name: str, layer: int, member: Member):
+        parent = name.rpartition('/')[0]
+        if parent not in self._children:
+            self._remove(parent)
+            self._add(parent, layer, Member(parent, 'd', mode=0o755))
+        self._entries[name] = (layer, member)
+        self._children[parent].add(name)
+        if member.kind == 'd':
+            self._children.setdefault(name, set())
+
+    def _entry(self, path: Path) -> Tuple[int, Member]:
+        '''Get the entry of a path, following symbolic links.'''
+        entry = self._entries.get(self._resolve(self._name(path)))
+        if entry is None:
+            raise FileNotFoundError(path)
+        return entry
+
+    def _listdir(self, name: str) -> List[str]:
+        name = self._resolve(name)
+        if name not in self._children:
+            raise NotADirectoryError(name)
+        return [child.rpartition('/')[2] for child in self._children[name]]
+
+    def _locate(self, name: str) -> str:
+        '''Resolve symbolic links of parent directories.'''
+        dirname, basename = name.rpartition('/')[::2]
+        return _join(self._resolve(dirname), basename)
+
+    def _merge(self, layer: int, table: List[Member]):
+        '''Merge a layer over lower ones.'''
+
+        # Whiteouts only apply to lower layers.
+        for member in table:
+            if member.kind == 'w':
+                self._remove(self._locate(member.name))
+            elif member.kind == 'o':
+                name = self._resolve(member.name)
+                for child in list(self._children.get(name, ())):
+                    self._remove(child)
+
+        for member in table:
+            if member.kind in ('w', 'o'):
+                continue
+            name = self._locate(member.name)
+            previous = self._entries.get(name)
+            if previous is not None:
+                if (member.kind == 'd') and (previous[1].kind == 'd'):
+                    continue
+                self._remove(name)
+            if member.kind == 'h':
+                # Hardlinks are resolved within their own layer.
+                target = self._entries.get(self._resolve(member.linkname))
+                if (target is None) or (target[1].kind != 'f'):
+                    continue
+                member = target[1]._replace(name=name, mode=member.mode)
+            self._add(name, layer, member)
+
+    def _name(self, path: Path) -> str:
+        name = str(PurePosixPath(path).relative_to(self.root))
+        return '' if name == '.' else name
+
+    def _reader(self, layer: int):
+        try:
+            return self._readers[layer]
+        except KeyError:
+            path = self._layers[layer]
+            if path.name.endswith('.tar.zst'):
+                reader = ZstdReader(path)
+            elif path.name.endswith('.tar'):
+                reader = TarReader(path)
+            else:
+                reader = GzipReader(path)
+            self._readers[layer] = reader
+            return reader
+
+    def _remove(self, name: str):
+        if name not in self._entries:
+            return
+        for child in list(self._children.get(name, ())):
+            self._remove(child)
+        self._children.pop(name, None)
+        del self._entries[name]
+        self._children[name.rpartition('/')[0]].discard(name)
+
+    def _resolve(self, name: str) -> str:
+        '''Resolve symbolic links, as if the image root was the system one.'''
+
+        def linkname(name):
+            entry = self._entries.get(name)
+            if (entry is not None) and (entry[1].kind == 'l'):
+                return entry[1].linkname
+        return resolve_name(name, linkname)
+
+    def _write(self, layer: int, member: Member, dst: Path):
+        if member.kind != 'f':
+            raise IsADirectoryError(member.name)
+        data = self._reader(layer).read(member.offset, member.size)
+        with open(dst, 'wb') as f:
+            f.write(data)
+        if member.mode is not None:
+            dst.chmod(member.mode)
+
+
+def glob_names(
+    pattern: str,
+    listdir: Callable[[str], List[str]],
+    exists: Callable[[str], bool],
+    ) -> List[str]:
+    '''Get the entry names matching a pattern, given the tree structure.'''
+
+    matches = ['']
+    for part in PurePosixPath(pattern).parts:
+        candidates = []
+        for match in matches:
+            if glob.has_magic(part):
+                try:
+                    children = listdir(match)
+                except OSError:
+                    continue
+                for child in children:
+                    if child.startswith('.') and not part.startswith('.'):
+                        continue
+                    if fnmatch.fnmatchcase(child, part):
+                        candidates.append(_join(match, child))
+            else:
+                candidate = _join(match, part)
+                if exists(candidate):
+                    candidates.append(candidate)
+        matches = candidates
+    return sorted(matches)
+
+
+def resolve_name(name: str, linkname: Callable[[str], Optional[str]]) -> str:
+    '''Resolve the symbolic links of an entry name, within an image.
+
+    Links are resolved as if the image root was the system one, given the
+    target of entries (None for entries that are not symbolic links).
+    '''
+
+    parts = [part for part in name.split('/') if part]
+    resolved = ''
+    hops = 0
+    while parts:
+        part = parts.pop(0)
+        if part == '.':
+            continue
+        elif part == '..':
+            resolved = resolved.rpartition('/')[0]
+            continue
+        candidate = _join(resolved, part)
+        target = linkname(candidate)
+        if target is not None:
+            hops += 1
+            if hops > 40:
+                raise OSError(f'too many levels of symbolic links ({name})')
+            if target.startswith('/'):
+                resolved = ''
+            parts = [part for part in target.split('/') if part] + parts
+        else:
+            resolved = candidate
+    return resolved
+
+
+def _join(dirname: str, basename: str) -> str:
+    return f'{dirname}/{basename}' if dirname else basename
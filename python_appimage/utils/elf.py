@@ -0,0 +1,530 @@
+import atexit
+from dataclasses import astuple, dataclass
+import fnmatch
+import glob
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .log import debug
+
+
+__all__ = ['ElfCache', 'ElfInfo', 'ldd', 'persistent_cache', 'read_elf',
+           'set_rpath']
+
+
+PT_LOAD, PT_DYNAMIC, PT_INTERP = 1, 2, 3
+'''ELF program header types.'''
+
+DT_NULL, DT_NEEDED, DT_STRTAB, DT_SONAME, DT_RPATH, DT_RUNPATH = \
+    0, 1, 5, 14, 15, 29
+'''ELF dynamic section tags.'''
+
+LD_SO_CONF = '/etc/ld.so.conf'
+'''Configuration of the host dynamic loader search path.'''
+
+LOADERS = ('ld-linux*.so.*', 'ld64.so.*', 'ld.so.*')
+'''Names of dynamic loaders, which are not reported as dependencies.'''
+
+CACHE_SIZE = 20000
+'''Maximum number of entries (per table) of the persistent ELF cache.'''
+
+CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS elf (
+    path TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    info TEXT NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ldd (
+    path TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    dependencies TEXT NOT NULL,
+    accessed REAL NOT NULL
+);
+'''
+'''Schema of the persistent ELF cache.'''
+
+
+@dataclass(frozen=True)
+class ElfInfo:
+    '''Dynamic linking properties of an ELF file.'''
+
+    elf_class: int
+    '''File class, i.e. 32 or 64 (bits).'''
+
+    machine: int
+    '''Target architecture (e_machine).'''
+
+    interpreter: Optional[str] = None
+    '''Program interpreter (i.e. dynamic loader), for executables.'''
+
+    needed: Tuple[str, ...] = ()
+    '''Names of required shared libraries (DT_NEEDED).'''
+
+    rpath: Optional[str] = None
+    '''Library search path (DT_RPATH), superseded by runpath.'''
+
+    runpath: Optional[str] = None
+    '''Library search path (DT_RUNPATH).'''
+
+    soname: Optional[str] = None
+    '''Shared library name (DT_SONAME).'''
+
+
+    def compatible(self, other: 'ElfInfo') -> bool:
+        '''Check if two ELF files can be linked together.'''
+        return (self.elf_class == other.elf_class) and \
+               (self.machine == other.machine)
+
+
+class ElfCache:
+    '''Persistent cache of ELF properties and of resolved dependencies.
+
+    Entries are stored in an SQLite database, by file location. They are only
+    valid for the file status (inode, size and modification time) that they
+    were recorded with. Least recently used entries are evicted when closing
+    the cache. The cache is best effort, i.e. database errors are ignored.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+        self._accessed = {'elf': set(), 'ldd': set()}
+
+    def close(self):
+        with self._lock:
+            if self._db is None:
+                return
+            try:
+                now = time.time()
+                with self._db:
+                    for table, paths in self._accessed.items():
+                        self._db.executemany(
+                            f'UPDATE {table} SET accessed = ? WHERE path = ?',
+                            [(now, path) for path in paths])
+                        paths.clear()
+                for table in ('elf', 'ldd'):
+                    self._db.execute(
+                        f'DELETE FROM {table} WHERE path NOT IN (SELECT path '
+                        f'FROM {table} ORDER BY accessed DESC LIMIT ?)',
+                        (CACHE_SIZE,))
+            except sqlite3.Error:
+                pass
+            self._db.close()
+            self._db = None
+
+    def forget(self, path):
+        '''Remove the entries of a file.'''
+
+        for table in ('elf', 'ldd'):
+            self._put(f'DELETE FROM {table} WHERE path = ?', (path,))
+
+    def get_info(self, path, status):
+        '''Get the properties of an ELF file, if cached.'''
+
+        row = self._get('SELECT status, info FROM elf WHERE path = ?', path)
+        if (row is None) or (row[0] != status):
+            return None
+        values = json.loads(row[1])
+        values[3] = tuple(values[3]) # needed.
+        self._touch('elf', path)
+        return ElfInfo(*values)
+
+    def put_info(self, path, status, info):
+        '''Store the properties of an ELF file.'''
+
+        self._put('INSERT OR REPLACE INTO elf VALUES (?, ?, ?, ?)',
+                  (path, status, json.dumps(astuple(info)), time.time()))
+
+    def get_dependencies(self, path, status, environment):
+        '''Get the resolved dependencies of an ELF file, if cached.
+
+        Dependencies are only valid if none of them changed.
+        '''
+
+        row = self._get('SELECT status, environment, dependencies FROM ldd '
+                        'WHERE path = ?', path)
+        if (row is None) or (row[0] != status) or (row[1] != environment):
+            return None
+        dependencies = []
+        for dependency, dependency_status in json.loads(row[2]):
+            try:
+                if _status(dependency) != dependency_status:
+                    return None
+            except OSError:
+                return None
+            dependencies.append(dependency)
+        self._touch('ldd', path)
+        return dependencies
+
+    def put_dependencies(self, path, status, environment, dependencies):
+        '''Store the resolved dependencies of an ELF file.'''
+
+        dependencies = [(dependency, _status(dependency))
+                        for dependency in dependencies]
+        self._put('INSERT OR REPLACE INTO ldd VALUES (?, ?, ?, ?, ?)',
+                  (path, status, environment, json.dumps(dependencies),
+                   time.time()))
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None,
+                                 check_same_thread=False)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = OFF')
+            db.executescript(CACHE_SCHEMA)
+            self._db = db
+            atexit.register(self.close)
+        return self._db
+
+    def _get(self, query, path):
+        with self._lock:
+            try:
+                return self._connect().execute(query, (path,)).fetchone()
+            except (OSError, sqlite3.Error):
+                return None
+
+    def _put(self, query, values):
+        with self._lock:
+            try:
+                self._connect().execute(query, values)
+            except (OSError, sqlite3.Error):
+                pass
+
+    def _touch(self, table, path):
+        # Access times are updated when closing the cache.
+        with self._lock:
+            self._accessed[table].add(path)
+
+
+_cache: Dict[tuple, ElfInfo] = {}
+'''Properties of ELF files read so far, by file location and status.'''
+
+_persistent_cache: Optional[ElfCache] = None
+'''Persistent cache, shared across builds.'''
+
+
+def persistent_cache():
+    '''Get the persistent ELF cache (located under CACHE_DIR)
+    '''
+    global _persistent_cache
+
+    if _persistent_cache is None:
+        from .deps import CACHE_DIR # Avoid circular imports.
+        _persistent_cache = ElfCache(
+            os.path.join(CACHE_DIR, 'share/elf.sqlite'))
+    return _persistent_cache
+
+
+def _status(path):
+    st = os.stat(path)
+    return f'{st.st_ino}:{st.st_size}:{st.st_mtime_ns}'
+
+
+def read_elf(path, *, cache=True):
+    '''Read the dynamic linking properties of an ELF file
+
+    The file is memory mapped, and only its headers and dynamic section are
+    accessed. Results are cached (in memory, and on disk), as long as the file
+    is unchanged, unless cache is false (e.g. for temporary files).
+    '''
+
+    path = os.path.abspath(path)
+    if cache:
+        status = _status(path)
+        key = (path, status)
+        try:
+            return _cache[key]
+        except KeyError:
+            pass
+
+        info = persistent_cache().get_info(path, status)
+        if info is not None:
+            _cache[key] = info
+            return info
+
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty file.
+            raise ValueError(f'not an ELF file ({path})')
+        try:
+            info, _ = _parse(data, path)
+        finally:
+            data.close()
+
+    if cache:
+        _cache[key] = info
+        persistent_cache().put_info(path, status, info)
+    return info
+
+
+def _parse(data, path):
+    '''Parse an ELF file.
+
+    The file offsets of search path strings are also returned, by tag.
+    '''
+
+    if data[:4] != b'\x7fELF':
+        raise ValueError(f'not an ELF file ({path})')
+    elf_class = {1: 32, 2: 64}.get(data[4])
+    order = {1: '<', 2: '>'}.get(data[5])
+    if (elf_class is None) or (order is None):
+        raise ValueError(f'bad ELF header ({path})')
+
+    if elf_class == 64:
+        header = struct.unpack_from(f'{order}HHIQQQIHHH', data, 16)
+        phdr = f'{order}IIQQQQQQ'
+        dyn = f'{order}qQ'
+        def segment(entry):
+            type_, _, offset, vaddr, _, filesz = entry[:6]
+            return type_, offset, vaddr, filesz
+    else:
+        header = struct.unpack_from(f'{order}HHIIIIIHHH', data, 16)
+        phdr = f'{order}IIIIIIII'
+        dyn = f'{order}iI'
+        def segment(entry):
+            type_, offset, vaddr, _, filesz = entry[:5]
+            return type_, offset, vaddr, filesz
+    machine, phoff, phentsize, phnum = header[1], header[4], header[8], \
+                                       header[9]
+
+    loads, dynamic, interpreter = [], None, None
+    for i in range(phnum):
+        entry = struct.unpack_from(phdr, data, phoff + i * phentsize)
+        type_, offset, vaddr, filesz = segment(entry)
+        if type_ == PT_LOAD:
+            loads.append((vaddr, offset, filesz))
+        elif type_ == PT_DYNAMIC:
+            dynamic = (offset, filesz)
+        elif type_ == PT_INTERP:
+            interpreter = _string(data, offset)
+
+    if dynamic is None:
+        return ElfInfo(elf_class, machine, interpreter), {}
+
+    # Read the dynamic section.
+    entries = []
+    size = struct.calcsize(dyn)
+    offset, filesz = dynamic
+    for position in range(offset, offset + filesz, size):
+        tag, value = struct.unpack_from(dyn, data, position)
+        if tag == DT_NULL:
+            break
+        entries.append((tag, value))
+
+    # Map the string table address to a file offset.
+    strtab = None
+    for tag, value in entries:
+        if tag == DT_STRTAB:
+            for vaddr, offset, filesz in loads:
+                if vaddr <= value < vaddr + filesz:
+                    strtab = value - vaddr + offset
+                    break
+    if strtab is None:
+        raise ValueError(f'missing ELF string table ({path})')
+
+    strings = {DT_RPATH: None, DT_RUNPATH: None, DT_SONAME: None}
+    offsets = {}
+    needed = []
+    for tag, value in entries:
+        if tag == DT_NEEDED:
+            needed.append(_string(data, strtab + value))
+        elif tag in strings:
+            strings[tag] = _string(data, strtab + value)
+            if tag != DT_SONAME:
+                offsets[tag] = strtab + value
+
+    info = ElfInfo(elf_class, machine, interpreter, tuple(needed),
+                   strings[DT_RPATH], strings[DT_RUNPATH], strings[DT_SONAME])
+    return info, offsets
+
+
+def _string(data, offset):
+    end = data.find(b'\0', offset)
+    return data[offset:end].decode('utf-8', 'surrogateescape')
+
+
+def _encode(string):
+    return string.encode('utf-8', 'surrogateescape')
+
+
+def set_rpath(path, rpath, *, patchelf=None):
+    '''Set the RPATH (or RUNPATH) of an ELF file
+
+    The existing search path is overwritten in place if the new one fits in
+    its string slot, as patchelf would do. Otherwise, patchelf is used (e.g.
+    for adding a search path). Nothing is written if the search path is
+    already set.
+    '''
+
+    path = os.path.abspath(path)
+    info = read_elf(path)
+    current = [value for value in (info.rpath, info.runpath)
+               if value is not None]
+    if current and all(value == rpath for value in current):
+        return
+
+    encoded = _encode(rpath)
+    if current and all(len(encoded) <= len(_encode(value))
+                       for value in current):
+        debug('RPATH', f'{os.path.basename(path)} -> {rpath}')
+        with open(path, 'r+b') as f:
+            data = mmap.mmap(f.fileno(), 0)
+            try:
+                _, offsets = _parse(data, path)
+                for offset in offsets.values():
+                    data[offset:offset + len(encoded) + 1] = encoded + b'\0'
+                data.flush()
+            finally:
+                data.close()
+    else:
+        # Avoid circular imports (utils.deps depends on this module).
+        from .deps import ensure_patchelf, PATCHELF
+        from .system import system
+
+        if patchelf is None:
+            ensure_patchelf()
+            patchelf = PATCHELF
+        system((str(patchelf), '--set-rpath', f"'{rpath}'", path))
+
+    # The file status might not reflect the change (e.g. coarse timestamps).
+    for key in [key for key in _cache if key[0] == path]:
+        del _cache[key]
+    persistent_cache().forget(path)
+
+
+def ldd(path):
+    '''Get dependencies list of dynamic libraries
+
+    Dependencies are resolved as the host dynamic loader would do, but
+    without running it. The list holds the locations of all (transitive)
+    dependencies that could be found.
+    '''
+
+    path = os.path.abspath(path)
+    status = _status(path)
+    environment = os.environ.get('LD_LIBRARY_PATH', '')
+    cache = persistent_cache()
+    dependencies = cache.get_dependencies(path, status, environment)
+    if dependencies is not None:
+        return dependencies
+
+    root = read_elf(path)
+    found = {}
+    queue = [(path, root, ())]
+    while queue:
+        current, info, rpaths = queue.pop(0)
+        origin = os.path.dirname(os.path.realpath(current))
+        if info.runpath is None:
+            # RPATHs of loading objects also apply (unlike RUNPATHs).
+            rpaths = rpaths + _expand(info.rpath, origin, info)
+            search = rpaths + _ld_library_path(origin, info)
+        else:
+            search = _ld_library_path(origin, info) + \
+                     _expand(info.runpath, origin, info)
+        search += _system_dirs(info)
+
+        for name in info.needed:
+            if name in found:
+                continue
+            dep = _locate(name, search, root)
+            if dep is None:
+                debug('LDD', f'{name} not found (required by {current})')
+                continue
+            found[name] = dep
+            queue.append((dep, read_elf(dep), rpaths))
+
+    dependencies = [dep for name, dep in found.items() if not any(
+        fnmatch.fnmatchcase(name, loader) for loader in LOADERS)]
+    cache.put_dependencies(path, status, environment, dependencies)
+    return dependencies
+
+
+def _locate(name, search, root):
+    '''Locate a library, given search directories.'''
+
+    candidates = [name] if '/' in name else \
+                 (os.path.join(dirname, name) for dirname in search)
+    for candidate in candidates:
+        if not os.path.isfile(candidate):
+            continue
+        try:
+            info = read_elf(candidate)
+        except (OSError, ValueError):
+            continue
+        if info.compatible(root):
+            return candidate
+
+
+def _expand(path, origin, info):
+    '''Split a search path, expanding dynamic string tokens.'''
+
+    if not path:
+        return ()
+    lib = 'lib64' if info.elf_class == 64 else 'lib'
+    dirs = []
+    for dirname in path.split(':'):
+        for token, value in (('ORIGIN', origin), ('LIB', lib)):
+            dirname = dirname.replace(f'${{{token}}}', value) \
+                             .replace(f'${token}', value)
+        if dirname:
+            dirs.append(dirname)
+    return tuple(dirs)
+
+
+def _ld_library_path(origin, info):
+    return _expand(os.environ.get('LD_LIBRARY_PATH', '').replace(';', ':'),
+                   origin, info)
+
+
+def _system_dirs(info):
+    '''Get the system search path (from ld.so.conf, and default dirs).'''
+
+    dirs = _ld_so_conf(LD_SO_CONF)
+    if info.elf_class == 64:
+        dirs += ('/lib64', '/usr/lib64')
+    dirs += ('/lib', '/usr/lib')
+    return dirs
+
+
+_ld_so_conf_cache: Dict[str, Tuple[str, ...]] = {}
+
+
+def _ld_so_conf(path, depth=0):
+    try:
+        return _ld_so_conf_cache[path]
+    except KeyError:
+        pass
+
+    dirs: List[str] = []
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        lines = []
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        elif line.startswith('include') and (depth < 8):
+            for pattern in line.split()[1:]:
+                if not pattern.startswith('/'):
+                    pattern = os.path.join(os.path.dirname(path), pattern)
+                for included in sorted(glob.glob(pattern)):
+                    dirs += _ld_so_conf(included, depth + 1)
+        elif not line.startswith('hwcap'):
+            dirs.append(line)
+
+    result = tuple(dirs)
+    _ld_so_conf_cache[path] = result
+    return result
@@ -1,34 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
 import errno
+import fcntl
 import os
+import shutil
 
 try:
     from distutils.dir_util import mkpath as _mkpath
     from distutils.dir_util import remove_tree as _remove_tree
-    from distutils.file_util import copy_file as _copy_file
 
 except ImportError:
-    import shutil
-
     def _mkpath(path):
         os.makedirs(path, exist_ok=True)
 
     def _remove_tree(path):
         shutil.rmtree(path)
 
-    def _copy_file(source, destination, update=0):
-        if os.path.exists(source) and (
-            not update
-            or (
-                (not os.path.exists(destination))
-                or (os.path.getmtime(source) > os.path.getmtime(destination))
-            )
-        ):
-            shutil.copy(source, destination)
-
 from .log import debug
 
 
-__all__ = ['copy_file', 'copy_tree', 'make_tree', 'remove_file', 'remove_tree']
+__all__ = ['copy_file', 'copy_tree', 'fast_copy', 'make_tree', 'remove_file',
+           'remove_tree']
+
+
+BUFFER_SIZE = 1024 * 1024
+'''Buffer size, for copying files
+'''
+
+FICLONE = 0x40049409
+'''Linux ioctl request for cloning (reflinking) a file
+'''
 
 
 # Wrap some file system related functions
@@ -39,8 +39,56 @@ def make_tree(path):
     return _mkpath(path)
 
 
-def copy_file(source, destination, update=False, verbose=True):
+def _copy_data(source, destination):
+    '''Copy the content of a file, sharing its data if possible
+
+    The file is reflinked (on file systems that support it), or copied in
+    kernel space with copy_file_range, or copied with a buffer otherwise.
+    Files are not hardlinked, since copies might be patched in place (e.g.
+    RPATHs).
     '''
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+
+        try:
+            while os.copy_file_range(src.fileno(), dst.fileno(), BUFFER_SIZE):
+                pass
+            return
+        except (AttributeError, OSError):
+            # Not supported (e.g. across file systems, on old kernels).
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+
+        shutil.copyfileobj(src, dst, BUFFER_SIZE)
+
+
+def fast_copy(source, destination):
+    '''Copy a file and its permissions (following symlinks), like shutil.copy
+    '''
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    _copy_data(source, destination)
+    shutil.copymode(source, destination)
+    return destination
+
+
+def _copy_file(source, destination, update=False):
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    if update and os.path.exists(destination) and \
+       (os.path.getmtime(source) <= os.path.getmtime(destination)):
+        return
+    _copy_data(source, destination)
+    shutil.copystat(source, destination)
+
+
+def copy_file(source, destination, update=False, verbose=True):
+    '''Copy a file, preserving its permissions and times
     '''
     name = os.path.basename(source)
     if verbose:
@@ -48,31 +96,52 @@ def copy_file(source, destination, update=False, verbose=True):
     _copy_file(source, destination, update=update)
 
 
-def copy_tree(source, destination):
+def copy_tree(source, destination, update=True, ignore=None):
     '''Copy (or update) a directory preserving symlinks
+
+    Files are copied concurrently, by a pool of threads. Paths (relative to
+    the source) for which ignore returns true are not copied.
     '''
+    source, destination = os.fspath(source), os.fspath(destination)
     if not os.path.exists(source):
         raise OSError(errno.ENOENT, 'No such file or directory: ' + source)
 
     name = os.path.basename(source)
     debug('COPY', '%s from %s', name, os.path.dirname(source))
 
-    for root, _, files in os.walk(source):
-        relpath = os.path.relpath(root, source)
-        dirname = os.path.join(destination, relpath)
-        _mkpath(dirname)
-        for file_ in files:
-            src = os.path.join(root, file_)
-            dst = os.path.join(dirname, file_)
-            if os.path.islink(src):
-                try:
-                    os.remove(dst)
-                except OSError:
-                    pass
-                linkto = os.readlink(src)
-                os.symlink(linkto, dst)
-            else:
-                copy_file(src, dst, update=True, verbose=False)
+    def symlink(src, dst):
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        linkto = os.readlink(src)
+        os.symlink(linkto, dst)
+
+    with ThreadPoolExecutor() as executor:
+        futures = []
+        for root, dirs, files in os.walk(source):
+            relpath = os.path.relpath(root, source)
+            dirname = os.path.normpath(os.path.join(destination, relpath))
+            _mkpath(dirname)
+            if ignore is not None:
+                prefix = '' if relpath == '.' else relpath + os.sep
+                dirs[:] = [dir_ for dir_ in dirs if not ignore(prefix + dir_)]
+                files = [file_ for file_ in files
+                         if not ignore(prefix + file_)]
+            for dir_ in dirs:
+                src = os.path.join(root, dir_)
+                if os.path.islink(src):
+                    symlink(src, os.path.join(dirname, dir_))
+            for file_ in files:
+                src = os.path.join(root, file_)
+                dst = os.path.join(dirname, file_)
+                if os.path.islink(src):
+                    symlink(src, dst)
+                else:
+                    futures.append(
+                        executor.submit(_copy_file, src, dst, update=update))
+        for future in futures:
+            future.result()
 
 
 def remove_file(path):
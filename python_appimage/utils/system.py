@@ -3,6 +3,7 @@ import re
 import subprocess
 
 from .compat import decode, encode
+from .elf import ldd
 from .log import debug, log
 
 
@@ -61,13 +62,3 @@ def system(args, exclude=None, stdin=None):
                     log('WARNING', line[8:].strip())
 
     return str(decode(out).strip())
-
-
-_ldd_pattern = re.compile('=> (.+) [(]0x')
-
-
-def ldd(path):
-    '''Get dependencies list of dynamic libraries
-    '''
-    out = system(('ldd', path))
-    return _ldd_pattern.findall(out)
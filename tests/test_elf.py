@@ -0,0 +1,34 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+from python_appimage.utils import elf
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    '''Use a private persistent ELF cache.'''
+
+    cache = elf.ElfCache(str(tmp_path / 'elf.sqlite'))
+    monkeypatch.setattr(elf, '_persistent_cache', cache)
+    yield cache
+    cache.close()
+
+
+def test_ldd_cache(cache, monkeypatch):
+    path = os.path.realpath(sys.executable)
+    dependencies = elf.ldd(path)
+
+    # Dependencies are stored under the requested binary.
+    with sqlite3.connect(cache.path) as db:
+        keys = [row[0] for row in db.execute('SELECT path FROM ldd')]
+    assert keys == [path]
+
+    # The second lookup is served from the cache, without reading any ELF.
+    def read_elf(*args, **kwargs):
+        raise AssertionError('cache miss')
+
+    monkeypatch.setattr(elf, 'read_elf', read_elf)
+    assert elf.ldd(path) == dependencies